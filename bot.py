@@ -1,4 +1,5 @@
 # bot.py
+import asyncio
 import logging
 import os
 from dotenv import load_dotenv
@@ -27,14 +28,15 @@ from handlers.registration_handler import (
 )
 # Import the refactored log processing function and the entry point for /log command
 from handlers.log_handler import (
-    process_log_request, # Core logic
+    process_plain_message, # Intent check + logging for command-less messages
     log_command_entry,   # For /log command
-    handle_log_confirmation, 
-    handle_category_override_selection
+    handle_log_callback, # All log keyboard buttons
+    LOG_CALLBACK_PATTERN
 )
 from handlers.query_handlers import summary_command, details_command, category_command
 from handlers.report_handler import report_command
-from utils.intent_recognition_utils import get_message_intent, INTENT_LOG_EXPENSE # Import intent utils
+from handlers.admin_handler import flush_ai_cache_command, parse_admin_ids
+from services.ai_categorization_service import close_ai_http_client
 
 # Load environment variables from .env.local file
 load_dotenv(dotenv_path=".env.local") 
@@ -43,6 +45,8 @@ load_dotenv(dotenv_path=".env.local")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CONVEX_URL = os.getenv("CONVEX_URL")
 AI_SERVICE_URL = os.getenv("AI_SERVICE_URL") 
+# Optional: comma-separated Telegram user ids allowed to run ops commands like /flush_ai_cache
+ADMIN_TELEGRAM_IDS = parse_admin_ids(os.getenv("ADMIN_TELEGRAM_IDS", ""))
 
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN not found in .env.local file. Please add it.")
@@ -62,13 +66,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__) 
 
-try:
-    nlp = spacy.load("en_core_web_sm")
-    logger.info("spaCy model en_core_web_sm loaded successfully.")
-except OSError:
-    logger.error("spaCy model en_core_web_sm not found. Please run 'python -m spacy download en_core_web_sm'")
+SPACY_MODEL_NAME = "en_core_web_sm"
+if not spacy.util.is_package(SPACY_MODEL_NAME):
+    logger.error("spaCy model %s not found. Please run 'python -m spacy download %s'", SPACY_MODEL_NAME, SPACY_MODEL_NAME)
     exit()
 
+# The spaCy model takes seconds to load, so it is loaded on first use rather than at startup
+nlp = None
+_nlp_lock = asyncio.Lock()
+
+async def get_nlp():
+    """Returns the shared spaCy pipeline, loading it off the event loop on first use."""
+    global nlp
+    if nlp is None:
+        async with _nlp_lock:
+            if nlp is None:
+                loop = asyncio.get_running_loop()
+                nlp = await loop.run_in_executor(None, spacy.load, SPACY_MODEL_NAME)
+                logger.info("spaCy model %s loaded successfully.", SPACY_MODEL_NAME)
+    return nlp
+
 PREDEFINED_CATEGORIES: Dict[str, List[str]] = {
     "Food & Drink": ["food", "restaurant", "lunch", "dinner", "breakfast", "coffee", "tea", "groceries", "snack", "drinks", "meal", "takeaway", "delivery"],
     "Transport": ["transport", "bus", "train", "taxi", "uber", "lyft", "metro", "subway", "gas", "fuel", "parking", "flight", "car"],
@@ -90,11 +107,6 @@ PREDEFINED_CATEGORIES: Dict[str, List[str]] = {
 }
 DEFAULT_CATEGORY = "Other" 
 
-LOG_CONFIRM_YES_PREFIX = "log_confirm_yes_"
-LOG_CONFIRM_NO_PREFIX = "log_confirm_no_"
-CAT_OVERRIDE_PREFIX = "cat_override_" 
-CAT_CANCEL_LOG_PREFIX = "cat_cancel_log_"
-
 # --- New Message Handler for Command-less Intent ---
 async def handle_plain_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles plain text messages to determine intent."""
@@ -102,23 +114,25 @@ async def handle_plain_message(update: Update, context: ContextTypes.DEFAULT_TYP
         return 
 
     user_text = update.message.text
-    logger.info(f"Received plain text message from {update.message.from_user.id}: '{user_text}'")
+    logger.info("Received plain text message from %s: '%s'", update.message.from_user.id, user_text)
 
-    intent = get_message_intent(user_text, nlp) 
-
-    if intent == INTENT_LOG_EXPENSE:
-        logger.info(f"Intent recognized as LOG_EXPENSE for: '{user_text}'")
-        await process_log_request(
-            update, context, user_text, 
-            convex_client, nlp, PREDEFINED_CATEGORIES, DEFAULT_CATEGORY, AI_SERVICE_URL
-        )
-    else:
-        logger.info(f"Intent UNKNOWN or not a log attempt for: '{user_text}'. Ignoring.")
+    await process_plain_message(
+        update, context,
+        convex_client, await get_nlp(), PREDEFINED_CATEGORIES, DEFAULT_CATEGORY, AI_SERVICE_URL
+    )
 
 
 # --- Main Application Setup ---
 def main() -> None:
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    async def on_shutdown(app: Application) -> None:
+        await close_ai_http_client()
+
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     async def wrapped_registration_start(update, context):
         return await registration_start_command(update, context, convex_client)
@@ -136,39 +150,46 @@ def main() -> None:
     application.add_handler(registration_conv_handler)
 
     async def wrapped_log_command_entry(update, context): 
-        await log_command_entry(update, context, convex_client, nlp, PREDEFINED_CATEGORIES, DEFAULT_CATEGORY, AI_SERVICE_URL)
+        await log_command_entry(update, context, convex_client, await get_nlp(), PREDEFINED_CATEGORIES, DEFAULT_CATEGORY, AI_SERVICE_URL)
     
+    # Period parsing doesn't use spaCy, so these commands don't wait for the model to load
     async def wrapped_summary_command(update, context):
-        await summary_command(update, context, convex_client, nlp)
+        await summary_command(update, context, convex_client, None)
     
     async def wrapped_details_command(update, context):
         await details_command(update, context, convex_client)
     
     async def wrapped_category_command(update, context):
-        await category_command(update, context, convex_client, nlp, PREDEFINED_CATEGORIES)
+        await category_command(update, context, convex_client, None, PREDEFINED_CATEGORIES)
     
     async def wrapped_report_command(update, context):
-        await report_command(update, context, convex_client, nlp)
-    
-    async def wrapped_handle_log_confirmation(update, context):
-        await handle_log_confirmation(update, context, convex_client)
+        await report_command(update, context, convex_client, None)
     
-    async def wrapped_handle_category_override_selection(update, context):
-        await handle_category_override_selection(update, context, convex_client)
+    async def wrapped_handle_log_callback(update, context):
+        await handle_log_callback(update, context, convex_client)
+
+    async def wrapped_flush_ai_cache_command(update, context):
+        await flush_ai_cache_command(update, context, ADMIN_TELEGRAM_IDS)
+
+    # The log and query handlers run with block=False so one chat's spaCy/AI/Convex round trips
+    # don't hold up other chats; each chat's intent and log steps are serialized with a
+    # per-chat lock, and Convex calls are bounded per chat. Everything else (notably the
+    # registration ConversationHandler) keeps one-by-one processing.
 
     # Add Command Handlers
-    application.add_handler(CommandHandler("log", wrapped_log_command_entry)) 
-    application.add_handler(CommandHandler("summary", wrapped_summary_command))
-    application.add_handler(CommandHandler("details", wrapped_details_command))
-    application.add_handler(CommandHandler("category", wrapped_category_command))
-    application.add_handler(CommandHandler("report", wrapped_report_command))
+    application.add_handler(CommandHandler("log", wrapped_log_command_entry, block=False)) 
+    application.add_handler(CommandHandler("summary", wrapped_summary_command, block=False))
+    application.add_handler(CommandHandler("details", wrapped_details_command, block=False))
+    application.add_handler(CommandHandler("category", wrapped_category_command, block=False))
+    application.add_handler(CommandHandler("report", wrapped_report_command, block=False))
+    if ADMIN_TELEGRAM_IDS:
+        application.add_handler(CommandHandler("flush_ai_cache", wrapped_flush_ai_cache_command))
     
     # Add CallbackQueryHandlers
-    application.add_handler(CallbackQueryHandler(wrapped_handle_log_confirmation, pattern=f"^{LOG_CONFIRM_YES_PREFIX}|^^{LOG_CONFIRM_NO_PREFIX}"))
-    application.add_handler(CallbackQueryHandler(wrapped_handle_category_override_selection, pattern=f"^{CAT_OVERRIDE_PREFIX}|^^{CAT_CANCEL_LOG_PREFIX}"))
+    application.add_handler(CallbackQueryHandler(wrapped_handle_log_callback, pattern=LOG_CALLBACK_PATTERN, block=False))
 
     # Add MessageHandler for plain text (must be after CommandHandlers)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_plain_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_plain_message, block=False))
 
     logger.info("Bot starting (with command-less log intent recognition)...")
     application.run_polling()
@@ -91,17 +91,19 @@ export const getRecentExpenses = query({
   },
 });
 
-// New query function for fetching all expenses for a report
-export const getExpensesForReport = query({
+// Quotes a CSV field the way Python's csv.writer does by default (QUOTE_MINIMAL)
+const csvField = (value: string): string =>
+  /[",\r\n]/.test(value) ? `"${value.replace(/"/g, '""')}"` : value;
+
+// Report rows already joined into CSV text, so the bot can upload them without
+// receiving and re-serializing every expense row
+export const getExpenseReportCSV = query({
   args: {
     telegramChatId: v.string(),
     startDate: v.number(), // Start timestamp (milliseconds)
     endDate: v.number(),   // End timestamp (milliseconds)
-    // Optional: category could be added here too if needed for CSV reports
-    // category: v.optional(v.string()), 
   },
   handler: async (ctx, args) => {
-    // 1. Find the user
     const user = await ctx.db
       .query("users")
       .withIndex("by_telegram_chat_id", (q) => q.eq("telegramChatId", args.telegramChatId))
@@ -111,27 +113,30 @@ export const getExpensesForReport = query({
       throw new Error("User not found. Please /start or /register first.");
     }
 
-    // 2. Query expenses within the date range for the user
-    // Using the by_userId_date index for efficient filtering.
-    // Order by date ascending for the report.
     const expensesToReport: Doc<"expenses">[] = await ctx.db
       .query("expenses")
-      .withIndex("by_userId_date", (q) => 
+      .withIndex("by_userId_date", (q) =>
         q.eq("userId", user._id)
          .gte("date", args.startDate)
          .lte("date", args.endDate)
       )
-      .order("asc") // Order by date ascending for chronological report
+      .order("asc") // Chronological report
       .collect();
 
-    // 3. Return the expenses, potentially transforming fields for CSV friendliness
-    return expensesToReport.map(expense => ({
-        // Convert Convex Id to string if it's not already for easier CSV handling
-        // _id: expense._id.toString(), 
-        date: expense.date, // Keep as timestamp, will be formatted in Python
-        category: expense.category,
-        amount: expense.amount,
-        description: expense.description ?? "", // Ensure description is a string, not null
-    }));
+    // Same columns and formatting as the bot used to produce: UTC date, amount with 2 decimals
+    const lines = ["Date,Category,Amount,Description"];
+    for (const expense of expensesToReport) {
+      lines.push([
+        new Date(expense.date).toISOString().slice(0, 10),
+        csvField(expense.category),
+        expense.amount.toFixed(2),
+        csvField(expense.description ?? ""),
+      ].join(","));
+    }
+
+    return {
+      rowCount: expensesToReport.length,
+      csv: lines.join("\r\n") + "\r\n",
+    };
   },
 });
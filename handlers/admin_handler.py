@@ -0,0 +1,33 @@
+# handlers/admin_handler.py
+import logging
+from typing import FrozenSet
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from services.ai_categorization_service import clear_prediction_cache
+
+logger = logging.getLogger(__name__)
+
+def parse_admin_ids(raw_ids: str) -> FrozenSet[int]:
+    """Parses a comma-separated list of Telegram user ids (e.g. from ADMIN_TELEGRAM_IDS)."""
+    admin_ids = set()
+    for raw_id in raw_ids.split(","):
+        raw_id = raw_id.strip()
+        if not raw_id:
+            continue
+        try:
+            admin_ids.add(int(raw_id))
+        except ValueError:
+            logger.warning("Ignoring invalid admin Telegram id: '%s'", raw_id)
+    return frozenset(admin_ids)
+
+async def flush_ai_cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 admin_ids: FrozenSet[int]) -> None:
+    """Handles /flush_ai_cache: drops cached AI predictions, e.g. after the model was retrained."""
+    user_id = update.message.from_user.id
+    if user_id not in admin_ids:
+        logger.warning("User %s tried /flush_ai_cache without admin rights.", user_id)
+        return
+
+    clear_prediction_cache()
+    await update.message.reply_text("AI prediction cache cleared.")
@@ -1,25 +1,193 @@
 # handlers/log_handler.py
+import asyncio
+import base64
+import functools
 import logging
+import os
 import re
-import json 
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional, Dict, Any, List, Tuple 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import CallbackQuery, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, CallbackQueryHandler 
-import requests 
+from cachetools import TTLCache
+from spacy.tokens import Doc # For type hinting spaCy Doc
 
-from services.ai_categorization_service import get_ai_category_prediction
-from utils.log_processing_utils import extract_amount_from_text, prepare_text_for_ai
-from utils.parsing_utils import parse_date_to_timestamp 
+from services.ai_categorization_service import get_ai_category_prediction, invalidate_cached_prediction
+from services.convex_service import run_convex_mutation
+from utils.intent_recognition_utils import INTENT_LOG_EXPENSE, get_message_intent
+from utils.log_processing_utils import extract_amount_from_text, extract_amount_only, has_amount_candidate, prepare_text_for_ai
+from utils.nlp_cache import NER_ONLY_DISABLED_PIPES, get_doc_batched
+from utils.parsing_utils import parse_date_to_timestamp, today_to_timestamp
 
 logger = logging.getLogger(__name__)
 
-LOG_CONFIRM_YES_PREFIX = "log_confirm_yes_" 
-LOG_CONFIRM_NO_PREFIX = "log_confirm_no_"   
-CAT_OVERRIDE_PREFIX = "cat_override_"       
-CAT_CANCEL_LOG_PREFIX = "cat_cancel_log_"  
+# Callback data is "<code>|<log attempt key>|<payload>"; the code selects the handler in
+# _CALLBACK_DISPATCH. "|" is not in the base64 alphabet used for keys.
+LOG_CONFIRM_YES_CODE = "ly"
+LOG_CONFIRM_NO_CODE = "ln"
+CAT_OVERRIDE_CODE = "co"
+CAT_CANCEL_LOG_CODE = "cx"
+CALLBACK_SEPARATOR = "|"
+LOG_CALLBACK_PATTERN = "^(?:{}){}".format(
+    "|".join((LOG_CONFIRM_YES_CODE, LOG_CONFIRM_NO_CODE, CAT_OVERRIDE_CODE, CAT_CANCEL_LOG_CODE)),
+    re.escape(CALLBACK_SEPARATOR),
+)
+
+def _callback_data(code: str, log_attempt_key: str, payload: str = "") -> str:
+    return CALLBACK_SEPARATOR.join((code, log_attempt_key, payload))
 
 CATEGORY_CONFIDENCE_THRESHOLD = 0.60 
+# Leading "/log" or "/log@BotName" command plus the whitespace after it
+_LOG_CMD_RE = re.compile(r'^/log(?:@\w+)?\s*')
+
+# Pending log attempts from all chats share one bounded TTLCache in bot_data, keyed by
+# (chat id, log attempt key), so abandoned confirmations expire and total memory is capped
+PENDING_LOGS_BOT_DATA_KEY = "_log_attempts"
+PENDING_LOGS_MAX_SIZE = 10000
+PENDING_LOGS_TTL_SECONDS = 600
+
+def _pending_logs(bot_data: Dict[str, Any]) -> TTLCache:
+    """Returns the shared pending log attempt cache, creating it on first use."""
+    pending_logs = bot_data.get(PENDING_LOGS_BOT_DATA_KEY)
+    if pending_logs is None:
+        pending_logs = TTLCache(maxsize=PENDING_LOGS_MAX_SIZE, ttl=PENDING_LOGS_TTL_SECONDS)
+        bot_data[PENDING_LOGS_BOT_DATA_KEY] = pending_logs
+    return pending_logs
+
+def _make_log_attempt_key(message_id: int) -> str:
+    """Compact url-safe base64 key derived from the message id (keeps callback_data short)."""
+    raw = message_id.to_bytes(max(1, (message_id.bit_length() + 7) // 8), "big")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+@functools.lru_cache(maxsize=1024)
+def _format_expense_date(timestamp_ms: int) -> str:
+    """Display string for an expense date; timestamps are day-granular, so this mostly hits the cache."""
+    return datetime.fromtimestamp(timestamp_ms / 1000).strftime('%Y-%m-%d (%A)')
+
+# Shared pool for the CPU-bound spaCy/regex parsing so it doesn't pin the event loop
+NLP_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="nlp")
+
+def _parse_log_text(full_text_to_parse: str, doc: Doc) -> Tuple[Optional[float], str, Optional[str], Optional[int]]:
+    """
+    Extracts the amount, description and date from an already parsed log request.
+    Returns:
+        Tuple: (amount, amount_text_for_removal, description_for_ai, expense_timestamp)
+               description and timestamp are None when no valid amount was found.
+    """
+    amount, amount_text_for_removal, amount_span = extract_amount_from_text(full_text_to_parse, doc)
+    if amount is None or amount <= 0:
+        return amount, amount_text_for_removal, None, None
+
+    description_for_ai = prepare_text_for_ai(full_text_to_parse, doc, amount_span)
+    # The date comes from the same Doc's DATE entities, so no second lookup or thread hop
+    expense_timestamp = parse_date_to_timestamp(None, full_text_to_parse, None, doc=doc)
+    return amount, amount_text_for_removal, description_for_ai, expense_timestamp
+
+
+# Descriptions shorter than this, or made only of digits/currency, skip the AI call
+_MIN_AI_DESCRIPTION_LENGTH = 3
+_AMOUNT_ONLY_CHARS_TABLE = str.maketrans("", "", "$€£.,")
+
+def _is_uninformative_description(description: str) -> bool:
+    """True if the AI can't categorize it anyway: "N/A", too short, or only an amount."""
+    stripped = description.strip()
+    if stripped == "N/A" or len(stripped) < _MIN_AI_DESCRIPTION_LENGTH:
+        return True
+    return stripped.translate(_AMOUNT_ONLY_CHARS_TABLE).isdigit()
+
+# Common categories offered as quick picks when the AI is unsure
+_COMMON_CATS = ("Food & Drink", "Transport", "Shopping", "Utilities")
+_MAX_COMMON_CAT_BUTTONS = 3
+
+_QUICK_PICKS_BOT_DATA_KEY = "_quick_pick_categories"
+
+def _quick_pick_categories(bot_data: Dict[str, Any], predefined_categories: dict) -> Tuple[str, ...]:
+    """_COMMON_CATS that exist in predefined_categories, computed once and kept in bot_data."""
+    quick_picks = bot_data.get(_QUICK_PICKS_BOT_DATA_KEY)
+    if quick_picks is None:
+        if isinstance(predefined_categories, dict):
+            quick_picks = tuple(cat for cat in _COMMON_CATS if cat in predefined_categories)
+        else:
+            quick_picks = ()
+        bot_data[_QUICK_PICKS_BOT_DATA_KEY] = quick_picks
+    return quick_picks
+
+def _override_suggestions(ai_cat: str, default_cat: str, quick_pick_categories: Tuple[str, ...]) -> List[str]:
+    """Categories offered when AI confidence is low: AI pick, up to 3 quick picks, then the default."""
+    suggestions = [ai_cat] if ai_cat else []
+    added = 0
+    for cat in quick_pick_categories:
+        if added >= _MAX_COMMON_CAT_BUTTONS:
+            break
+        if cat in suggestions:
+            continue
+        suggestions.append(cat)
+        added += 1
+    if default_cat not in suggestions:
+        suggestions.append(default_cat)
+    return suggestions
+
+def _build_override_keyboard(suggestions: List[str], ai_cat: str, log_attempt_key: str) -> InlineKeyboardMarkup:
+    """
+    Builds the category-selection keyboard shown when AI confidence is low.
+    Buttons carry the index into suggestions rather than the category name, so
+    callback_data stays short whatever the category is called.
+    """
+    buttons = [
+        InlineKeyboardButton(f"✅ Use '{cat}'" if idx == 0 and ai_cat else cat,
+                             callback_data=_callback_data(CAT_OVERRIDE_CODE, log_attempt_key, str(idx)))
+        for idx, cat in enumerate(suggestions)
+    ]
+    keyboard_layout = [list(pair) for pair in zip(buttons[::2], buttons[1::2])]
+    if len(buttons) % 2:
+        keyboard_layout.append([buttons[-1]])
+    keyboard_layout.append([InlineKeyboardButton("❌ Cancel Log", callback_data=_callback_data(CAT_CANCEL_LOG_CODE, log_attempt_key))])
+    return InlineKeyboardMarkup(keyboard_layout)
+
+# Last text/markup shown per (chat id, message id), so repeated identical edits (double taps,
+# retries) skip the API call that Telegram would reject with "message is not modified"
+_last_edits: TTLCache = TTLCache(maxsize=10000, ttl=600)
+
+async def _safe_edit(query: CallbackQuery, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+    """edit_message_text for callback queries that skips no-op edits and never raises BadRequest."""
+    message = query.message
+    edit_key = (message.chat_id, message.message_id) if message else None
+    edit_hash = hash((text, reply_markup.to_json() if reply_markup else None))
+    if edit_key is not None and _last_edits.get(edit_key) == edit_hash:
+        logger.debug("Skipping identical edit of message %s.", edit_key)
+        return
+    try:
+        await query.edit_message_text(text=text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            logger.warning("Could not edit callback message %s: %s", edit_key, e)
+        return
+    if edit_key is not None:
+        _last_edits[edit_key] = edit_hash
+
+def _build_final_markup(log_attempt_key: str) -> InlineKeyboardMarkup:
+    """Yes/No keyboard for the final confirmation of a log attempt."""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Yes, Log It!", callback_data=_callback_data(LOG_CONFIRM_YES_CODE, log_attempt_key)),
+        InlineKeyboardButton("❌ No, Cancel", callback_data=_callback_data(LOG_CONFIRM_NO_CODE, log_attempt_key)),
+    ]])
+
+
+
+# Updates are handled concurrently (see bot.py); this lock keeps one chat's log steps in order.
+# Entries disappear once no handler for that chat holds the lock.
+_chat_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _get_chat_lock(chat_id: int) -> asyncio.Lock:
+    lock = _chat_locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _chat_locks[chat_id] = lock
+    return lock
+
 
 async def process_log_request( # Renamed from log_command_v2 for clarity
                          update: Update, 
@@ -32,25 +200,75 @@ async def process_log_request( # Renamed from log_command_v2 for clarity
                          ai_service_url: str) -> None: 
     """
     Core logic for processing a log request, whether from /log command or command-less intent.
+    Serialized per chat; other chats proceed concurrently.
+    """
+    async with _get_chat_lock(update.effective_chat.id):
+        await _process_log_request(update, context, full_text_to_parse, convex_client, nlp_processor,
+                                   predefined_categories_for_buttons, default_category_fallback, ai_service_url)
+
+
+async def process_plain_message(update: Update,
+                                context: ContextTypes.DEFAULT_TYPE,
+                                convex_client: any,
+                                nlp_processor: any,
+                                predefined_categories_for_buttons: dict,
+                                default_category_fallback: str,
+                                ai_service_url: str) -> None:
     """
+    Entry point for command-less messages: recognizes the intent and, for expenses, logs it.
+    The intent step runs under the same per-chat lock as the log steps, so a chat's messages
+    are handled in the order they arrived.
+    """
+    user_text = update.message.text
+    async with _get_chat_lock(update.effective_chat.id):
+        # Intent recognition parses the message with spaCy, so it runs on the NLP pool, not the event loop
+        loop = asyncio.get_running_loop()
+        intent = await loop.run_in_executor(NLP_EXECUTOR, get_message_intent, user_text, nlp_processor)
+        if intent != INTENT_LOG_EXPENSE:
+            logger.info("Intent UNKNOWN or not a log attempt for: '%s'. Ignoring.", user_text)
+            return
+        logger.info("Intent recognized as LOG_EXPENSE for: '%s'", user_text)
+        await _process_log_request(update, context, user_text, convex_client, nlp_processor,
+                                   predefined_categories_for_buttons, default_category_fallback, ai_service_url)
+
+
+async def _process_log_request(update: Update,
+                               context: ContextTypes.DEFAULT_TYPE,
+                               full_text_to_parse: str,
+                               convex_client: any, 
+                               nlp_processor: any,
+                               predefined_categories_for_buttons: dict, 
+                               default_category_fallback: str, 
+                               ai_service_url: str) -> None: 
     telegram_chat_id = str(update.message.from_user.id)
 
     if not full_text_to_parse: # Check the passed text
         await update.message.reply_text("No expense details provided to log.")
         return
 
-    logger.info(f"User {telegram_chat_id} attempting to log: '{full_text_to_parse}'")
-    doc = nlp_processor(full_text_to_parse) 
-    
-    amount, amount_text_for_removal = extract_amount_from_text(full_text_to_parse, doc)
+    logger.info("User %s attempting to log: '%s'", telegram_chat_id, full_text_to_parse)
+    if not has_amount_candidate(full_text_to_parse):
+        logger.debug("No digits in '%s'; skipping spaCy parse.", full_text_to_parse)
+        await update.message.reply_text("Could not determine a valid positive amount from your message.")
+        return
+
+    amount_only = extract_amount_only(full_text_to_parse)
+    if amount_only is not None:
+        logger.debug("'%s' is just an amount; skipping spaCy parse.", full_text_to_parse)
+        amount, amount_text_for_removal, _ = amount_only
+        description_for_ai_prediction = "N/A"
+        expense_timestamp = today_to_timestamp()  # Nothing but the amount, so no date to parse
+    else:
+        # spaCy runs on NLP_EXECUTOR, batched with messages that queue up behind a running parse.
+        # Only entities and token text are read, so the tagger/parser/lemmatizer are skipped.
+        doc = await get_doc_batched(nlp_processor, full_text_to_parse, NLP_EXECUTOR, NER_ONLY_DISABLED_PIPES)
+        amount, amount_text_for_removal, description_for_ai_prediction, expense_timestamp = _parse_log_text(
+            full_text_to_parse, doc
+        )
 
     if amount is None or amount <= 0:
         await update.message.reply_text("Could not determine a valid positive amount from your message.")
         return
-
-    expense_timestamp = parse_date_to_timestamp(None, full_text_to_parse, nlp_processor)
-    
-    description_for_ai_prediction = prepare_text_for_ai(full_text_to_parse, doc, amount_text_for_removal)
     
     final_description_for_expense = description_for_ai_prediction
     if len(final_description_for_expense) > 100: 
@@ -58,13 +276,19 @@ async def process_log_request( # Renamed from log_command_v2 for clarity
     if not final_description_for_expense.strip(): 
         final_description_for_expense = "N/A"
 
-    ai_predicted_category, ai_confidence = get_ai_category_prediction(description_for_ai_prediction, ai_service_url)
+    ai_called = not _is_uninformative_description(final_description_for_expense)
+    if ai_called:
+        ai_predicted_category, ai_confidence = await get_ai_category_prediction(final_description_for_expense, ai_service_url)
+    else:
+        logger.debug("Description '%s' is too short or numeric for the AI. Skipping prediction.", final_description_for_expense)
+        ai_predicted_category, ai_confidence = None, 0.0
 
     final_category = default_category_fallback 
     if ai_predicted_category:
         final_category = ai_predicted_category
     else: 
-        logger.warning("AI service did not return a category. Using default fallback.")
+        if ai_called: # Skipping the AI on purpose is not a failure
+            logger.warning("AI service did not return a category. Using default fallback.")
         ai_confidence = 0.0 
 
     parsed_expense_details = {
@@ -75,65 +299,39 @@ async def process_log_request( # Renamed from log_command_v2 for clarity
         "date": expense_timestamp,
         "original_text_for_ai": description_for_ai_prediction, 
         "ai_suggested_category": ai_predicted_category, 
-        "ai_confidence": ai_confidence
+        "ai_confidence": ai_confidence,
+        # Display strings formatted once and reused by every confirmation message
+        "_date_str": _format_expense_date(expense_timestamp),
+        "_amount_str": f"${amount:.2f}",
     }
     
-    log_attempt_key = f"log_attempt_{update.message.message_id}"
-    context.chat_data[log_attempt_key] = parsed_expense_details
-    logger.info(f"Stored initial parsed expense data with key: {log_attempt_key}. Data: {parsed_expense_details}")
+    log_attempt_key = _make_log_attempt_key(update.message.message_id)
+    _pending_logs(context.bot_data)[(update.message.chat_id, log_attempt_key)] = parsed_expense_details
+    logger.debug("Stored initial parsed expense data with key: %s. Data: %s", log_attempt_key, parsed_expense_details)
 
-    confidence_log_str = f"{ai_confidence * 100:.0f}%" if ai_confidence is not None else "N/A"
+    confidence_str = f"{ai_confidence * 100:.0f}%" if ai_confidence is not None else "N/A"
     if ai_confidence is not None and ai_confidence >= CATEGORY_CONFIDENCE_THRESHOLD:
-        logger.info(f"AI confidence ({confidence_log_str}) is high. Proceeding to final confirmation.")
+        logger.debug("AI confidence (%s) is high. Proceeding to final confirmation.", confidence_str)
         await send_final_log_confirmation(update, context, log_attempt_key, parsed_expense_details)
     else:
-        logger.info(f"AI confidence ({confidence_log_str}) is low or AI failed. Asking user to confirm/select category.")
-        keyboard_buttons = []
-        ai_cat_str = str(ai_predicted_category) if ai_predicted_category is not None else ""
-
-        if ai_predicted_category:
-            keyboard_buttons.append(
-                InlineKeyboardButton(f"✅ Use '{ai_cat_str}'", callback_data=f"{CAT_OVERRIDE_PREFIX}{ai_cat_str}_{log_attempt_key}")
-            )
-        
-        suggestions_made = {ai_cat_str} if ai_predicted_category else set()
-        
-        if isinstance(predefined_categories_for_buttons, dict):
-            common_cats_for_buttons = [
-                cat for cat in ["Food & Drink", "Transport", "Shopping", "Utilities", default_category_fallback] 
-                if cat not in suggestions_made and cat in predefined_categories_for_buttons
-            ]
-            for cat_suggestion in common_cats_for_buttons[:3]: 
-                if cat_suggestion not in suggestions_made:
-                    keyboard_buttons.append(
-                        InlineKeyboardButton(f"{cat_suggestion}", callback_data=f"{CAT_OVERRIDE_PREFIX}{cat_suggestion}_{log_attempt_key}")
-                    )
-                    suggestions_made.add(cat_suggestion)
-        
-        default_cat_str = str(default_category_fallback)
-        if default_cat_str not in suggestions_made:
-             keyboard_buttons.append(
-                InlineKeyboardButton(f"{default_cat_str}", callback_data=f"{CAT_OVERRIDE_PREFIX}{default_cat_str}_{log_attempt_key}")
-            )
-
-        keyboard_layout = [keyboard_buttons[i:i + 2] for i in range(0, len(keyboard_buttons), 2)]
-        keyboard_layout.append([InlineKeyboardButton("❌ Cancel Log", callback_data=f"{CAT_CANCEL_LOG_PREFIX}{log_attempt_key}")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard_layout)
-        
-        confidence_display_str = f"{ai_confidence*100:.0f}%" if ai_confidence is not None else "N/A"
-        display_ai_suggestion = f"'{ai_cat_str}' (Confidence: {confidence_display_str})" if ai_predicted_category else "unavailable"
+        logger.debug("AI confidence (%s) is low or AI failed. Asking user to confirm/select category.", confidence_str)
+        ai_cat_str = ai_predicted_category or ""
+        quick_picks = _quick_pick_categories(context.bot_data, predefined_categories_for_buttons)
+        suggestions = _override_suggestions(ai_cat_str, default_category_fallback, quick_picks)
+        parsed_expense_details["_suggestions"] = suggestions
+        reply_markup = _build_override_keyboard(suggestions, ai_cat_str, log_attempt_key)
         
         message_text_desc_hint = final_description_for_expense if final_description_for_expense != "N/A" else description_for_ai_prediction
         if not message_text_desc_hint: message_text_desc_hint = "your input"
 
-        message_text = (
-            f"🤖 My AI suggests category: {display_ai_suggestion}.\n"
-            f"For: '{message_text_desc_hint}'\n\n" 
-            f"Please confirm or choose a different category:"
-        )
-        if not ai_predicted_category: 
-             message_text = (
+        if ai_predicted_category:
+            message_text = (
+                f"🤖 My AI suggests category: '{ai_cat_str}' (Confidence: {confidence_str}).\n"
+                f"For: '{message_text_desc_hint}'\n\n" 
+                f"Please confirm or choose a different category:"
+            )
+        else:
+            message_text = (
                 f"🤖 My AI couldn't determine a category for: '{message_text_desc_hint}'.\n"
                 f"Please choose a category:"
             )
@@ -146,7 +344,8 @@ async def log_command_entry(update: Update, context: ContextTypes.DEFAULT_TYPE,
                          default_category_fallback: str, 
                          ai_service_url: str) -> None:
     # Extract text after the /log command itself
-    full_text_after_log_command = update.message.text.split('/log', 1)[1].strip() if '/log' in update.message.text else ""
+    log_cmd_match = _LOG_CMD_RE.match(update.message.text)
+    full_text_after_log_command = update.message.text[log_cmd_match.end():].strip() if log_cmd_match else ""
     if not full_text_after_log_command:
         await update.message.reply_text(
             "Please provide expense details after /log.\n"
@@ -165,7 +364,7 @@ async def log_command_entry(update: Update, context: ContextTypes.DEFAULT_TYPE,
 async def send_final_log_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE, 
                                       log_attempt_key: str, 
                                       expense_details: Dict[str, Any]):
-    logger.info(f"Sending final log confirmation for key {log_attempt_key}. Details: {expense_details}")
+    logger.debug("Sending final log confirmation for key %s. Details: %s", log_attempt_key, expense_details)
     
     amount = expense_details.get("amount")
     category = expense_details.get("category") 
@@ -173,7 +372,7 @@ async def send_final_log_confirmation(update: Update, context: ContextTypes.DEFA
     expense_timestamp = expense_details.get("date")
 
     if None in [amount, category, description, expense_timestamp]:
-        logger.error(f"Missing data in expense_details for final confirmation: {expense_details}")
+        logger.error("Missing data in expense_details for final confirmation: %s", expense_details)
         target_message = update.callback_query.message if update.callback_query else update.message
         if target_message:
             try:
@@ -184,161 +383,160 @@ async def send_final_log_confirmation(update: Update, context: ContextTypes.DEFA
 
     confirmation_message = (
         f"Please confirm this expense:\n\n"
-        f"💰 Amount: ${amount:.2f}\n"
+        f"💰 Amount: {expense_details['_amount_str']}\n"
         f"🏷️ Category: {category}\n" 
         f"📝 Description: {description}\n" 
-        f"🗓️ Date: {datetime.fromtimestamp(expense_timestamp/1000).strftime('%Y-%m-%d (%A)')}\n\n"
+        f"🗓️ Date: {expense_details['_date_str']}\n\n"
         f"Is this correct?"
     )
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Yes, Log It!", callback_data=f"{LOG_CONFIRM_YES_PREFIX}{log_attempt_key}"),
-            InlineKeyboardButton("❌ No, Cancel", callback_data=f"{LOG_CONFIRM_NO_PREFIX}{log_attempt_key}")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _build_final_markup(log_attempt_key)
 
     if update.callback_query: 
-        await update.callback_query.edit_message_text(text=confirmation_message, reply_markup=reply_markup)
+        await _safe_edit(update.callback_query, confirmation_message, reply_markup)
     elif update.message: 
         await update.message.reply_text(text=confirmation_message, reply_markup=reply_markup)
 
 
-async def handle_category_override_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, convex_client: any) -> None:
+async def handle_log_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, convex_client: any) -> None:
+    """Single entry point for all log keyboard buttons; dispatches on the callback code."""
     query = update.callback_query
     await query.answer()
-    
-    callback_data_full = query.data
-    logger.info(f"Received category override callback: {callback_data_full}")
 
-    chosen_category = None 
-    log_attempt_key = None 
+    logger.debug("Received log callback: %s", query.data)
+    code, _, rest = query.data.partition(CALLBACK_SEPARATOR)
+    log_attempt_key, _, payload = rest.partition(CALLBACK_SEPARATOR)
+    handler = _CALLBACK_DISPATCH.get(code)
+    if handler is None or not log_attempt_key:
+        logger.warning("Unknown log callback: %s", query.data)
+        await _safe_edit(query, "Invalid selection.")
+        return
+    async with _get_chat_lock(update.effective_chat.id):
+        await handler(update, context, log_attempt_key, payload, convex_client)
 
-    if callback_data_full.startswith(CAT_OVERRIDE_PREFIX):
-        data_after_prefix = callback_data_full[len(CAT_OVERRIDE_PREFIX):]
-        key_marker_actual_start = "log_attempt_" 
-        idx_key_marker_separator = data_after_prefix.rfind(f"_{key_marker_actual_start}")
 
-        if idx_key_marker_separator != -1:
-            chosen_category = data_after_prefix[:idx_key_marker_separator] 
-            log_attempt_key = data_after_prefix[idx_key_marker_separator+1:] 
-            logger.info(f"Parsed from CAT_OVERRIDE: chosen_category='{chosen_category}', log_attempt_key='{log_attempt_key}'")
-        else:
-            logger.error(f"Could not properly parse category and key from CAT_OVERRIDE_PREFIX data: {data_after_prefix}")
-            await query.edit_message_text("Error processing your selection (key parsing failed).")
-            return
-            
-    elif callback_data_full.startswith(CAT_CANCEL_LOG_PREFIX):
-        log_attempt_key = callback_data_full[len(CAT_CANCEL_LOG_PREFIX):]
-        if log_attempt_key in context.chat_data:
-            context.chat_data.pop(log_attempt_key, None) 
-        await query.edit_message_text("Logging cancelled as requested.")
-        logger.info(f"User cancelled logging during category selection for key {log_attempt_key}.")
-        return
-    else:
-        logger.warning(f"Unknown prefix in category override callback: {callback_data_full}")
-        await query.edit_message_text("Invalid selection.")
-        return
+async def _take_pending_log(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                            log_attempt_key: str, remove: bool) -> Optional[Dict[str, Any]]:
+    """Looks up (or pops) the pending log attempt, telling the user if it has expired."""
+    pending_logs = _pending_logs(context.bot_data)
+    pending_log_id = (update.effective_chat.id, log_attempt_key)
+    expense_details = pending_logs.pop(pending_log_id, None) if remove else pending_logs.get(pending_log_id)
+    if not expense_details:
+        logger.warning("Could not find pending log data for key: '%s'. Pending log attempts: %d", log_attempt_key, len(pending_logs))
+        await _safe_edit(update.callback_query, "Sorry, something went wrong or this request expired.")
+    return expense_details
 
-    if not log_attempt_key or log_attempt_key not in context.chat_data:
-        logger.warning(f"Could not find pending log data for key: '{log_attempt_key}' in category override. chat_data keys: {list(context.chat_data.keys())}")
-        await query.edit_message_text(text="Sorry, something went wrong or this request expired.")
-        return
 
-    pending_expense_details: Optional[Dict[str, Any]] = context.chat_data.get(log_attempt_key) 
+async def _on_category_override(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                log_attempt_key: str, payload: str, convex_client: any) -> None:
+    query = update.callback_query
+    try:
+        suggestion_idx = int(payload)
+    except ValueError:
+        logger.error("Could not parse the suggestion index from category override payload: %s", payload)
+        await _safe_edit(query, "Error processing your selection (key parsing failed).")
+        return
 
+    pending_expense_details = await _take_pending_log(update, context, log_attempt_key, remove=False)
     if not pending_expense_details:
-        logger.error(f"Pending expense details None for key {log_attempt_key} in category override.")
-        await query.edit_message_text(text="Error: Could not retrieve expense details.")
         return
-    
+
+    suggestions = pending_expense_details.get("_suggestions") or []
+    chosen_category = suggestions[suggestion_idx] if 0 <= suggestion_idx < len(suggestions) else None
     if chosen_category is not None: 
-        logger.info(f"User selected category '{chosen_category}' for log attempt {log_attempt_key}.")
+        logger.info("User selected category '%s' for log attempt %s.", chosen_category, log_attempt_key)
         pending_expense_details["category"] = chosen_category 
         await send_final_log_confirmation(update, context, log_attempt_key, pending_expense_details)
     else: 
-        logger.error(f"Chosen category was None for log_attempt_key {log_attempt_key} after parsing callback data.")
-        await query.edit_message_text("Error: No category was effectively selected.")
+        logger.error("Suggestion index %d is out of range for log_attempt_key %s.", suggestion_idx, log_attempt_key)
+        await _safe_edit(query, "Error: No category was effectively selected.")
 
 
-async def handle_log_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE, convex_client: any) -> None:
-    query = update.callback_query
-    await query.answer() 
+async def _on_cancel_log(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                         log_attempt_key: str, payload: str, convex_client: any) -> None:
+    _pending_logs(context.bot_data).pop((update.effective_chat.id, log_attempt_key), None) 
+    await _safe_edit(update.callback_query, "Logging cancelled as requested.")
+    logger.info("User cancelled logging during category selection for key %s.", log_attempt_key)
 
-    callback_data_full = query.data
-    logger.info(f"Received FINAL log confirmation callback: {callback_data_full}")
 
-    log_attempt_key = None
-    action = None
+async def _record_category_feedback(convex_client: any, expense_details: Dict[str, Any], log_attempt_key: str) -> None:
+    """Sends the AI-vs-user category feedback for a logged expense. Never raises."""
+    feedback_payload = {
+        "telegramChatId": expense_details["telegramChatId"],
+        "original_text_for_ai": expense_details.get("original_text_for_ai", "N/A"),
+        "ai_predicted_category": expense_details.get("ai_suggested_category"), 
+        "ai_confidence": expense_details.get("ai_confidence"), 
+        "user_chosen_category": expense_details["category"], 
+    }
+    ai_suggested_category = expense_details.get("ai_suggested_category")
+    if ai_suggested_category and ai_suggested_category != expense_details["category"]:
+        # The user corrected the AI; don't keep serving the rejected prediction from cache
+        invalidate_cached_prediction(expense_details["description"])
+    try:
+        feedback_result = await run_convex_mutation(convex_client, "feedback_mutations:recordCategoryFeedback", feedback_payload)
+        if feedback_result and feedback_result.get("success"):
+            logger.info("Category feedback recorded successfully for log_attempt_key %s.", log_attempt_key)
+        else:
+            logger.warning("Failed to record category feedback for log_attempt_key %s. Result: %s", log_attempt_key, feedback_result)
+    except Exception as fb_e:
+        logger.error("Error calling Convex recordCategoryFeedback mutation: %s", fb_e)
 
-    if callback_data_full.startswith(LOG_CONFIRM_YES_PREFIX):
-        action = "yes"
-        log_attempt_key = callback_data_full[len(LOG_CONFIRM_YES_PREFIX):]
-    elif callback_data_full.startswith(LOG_CONFIRM_NO_PREFIX):
-        action = "no"
-        log_attempt_key = callback_data_full[len(LOG_CONFIRM_NO_PREFIX):]
 
-    if not log_attempt_key or log_attempt_key not in context.chat_data:
-        logger.warning(f"Could not find final pending log data for key: '{log_attempt_key}'. chat_data keys: {list(context.chat_data.keys())}")
-        await query.edit_message_text(text="Sorry, something went wrong or this request expired.")
+async def _on_log_yes(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                      log_attempt_key: str, payload: str, convex_client: any) -> None:
+    query = update.callback_query
+    expense_details = await _take_pending_log(update, context, log_attempt_key, remove=True)
+    if not expense_details:
         return
 
-    full_expense_details: Optional[Dict[str, Any]] = context.chat_data.pop(log_attempt_key, None) 
+    logger.info("User confirmed FINAL logging for key %s. Full Details: %s", log_attempt_key, expense_details)
+    
+    expense_to_log_payload = {
+        "telegramChatId": expense_details["telegramChatId"],
+        "amount": expense_details["amount"],
+        "category": expense_details["category"], 
+        "description": expense_details["description"], 
+        "date": expense_details["date"],
+    }
+    try:
+        log_result = await run_convex_mutation(convex_client, "expenses:logExpense", expense_to_log_payload)
+        if log_result and log_result.get("success"):
+            # Confirming to the user and recording category feedback are independent round-trips
+            await asyncio.gather(
+                _safe_edit(
+                    query,
+                    f"✅ Expense logged successfully!\n"
+                    f"Amount: {expense_details['_amount_str']}\n"
+                    f"Category: {expense_details['category']}\n"
+                    f"Description: {expense_details['description']}\n"
+                    f"Date: {expense_details['_date_str']}",
+                ),
+                _record_category_feedback(convex_client, expense_details, log_attempt_key),
+            )
 
-    if not full_expense_details:
-        logger.error(f"Final expense data was None after pop for key: {log_attempt_key}")
-        await query.edit_message_text(text="Error: Could not retrieve expense details to log.")
+        else: 
+            error_msg = log_result.get("error", "Failed to log expense.") if log_result else "Failed to log expense (no response)."
+            await _safe_edit(query, f"⚠️ Error logging expense: {error_msg}")
+    except asyncio.TimeoutError:
+        # The mutation keeps running in the Convex worker and may still commit, so don't report a failure
+        logger.warning("Convex expenses:logExpense timed out for key %s; the expense may still be saved.", log_attempt_key)
+        await _safe_edit(query, "⏳ Saving your expense is taking longer than expected and it may already be saved. "
+                                "Please check /details before logging it again.")
+    except Exception as e: 
+        logger.error("Error calling Convex expenses:logExpense mutation after final confirmation: %s", e)
+        await _safe_edit(query, f"⚠️ An error occurred while logging your expense: {str(e)}")
+
+
+async def _on_log_no(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                     log_attempt_key: str, payload: str, convex_client: any) -> None:
+    if not await _take_pending_log(update, context, log_attempt_key, remove=True):
         return
+    logger.info("User cancelled FINAL logging for key %s.", log_attempt_key)
+    await _safe_edit(update.callback_query, "Logging cancelled. Feel free to try again with /log.")
 
-    if action == "yes":
-        logger.info(f"User confirmed FINAL logging for key {log_attempt_key}. Full Details: {full_expense_details}")
-        
-        expense_to_log_payload = {
-            "telegramChatId": full_expense_details["telegramChatId"],
-            "amount": full_expense_details["amount"],
-            "category": full_expense_details["category"], 
-            "description": full_expense_details["description"], 
-            "date": full_expense_details["date"],
-        }
-        try:
-            log_result = convex_client.mutation("expenses:logExpense", expense_to_log_payload)
-            if log_result and log_result.get("success"):
-                logged_date_obj = datetime.fromtimestamp(full_expense_details['date'] / 1000)
-                await query.edit_message_text(
-                    text=f"✅ Expense logged successfully!\n"
-                         f"Amount: ${full_expense_details['amount']:.2f}\n"
-                         f"Category: {full_expense_details['category']}\n"
-                         f"Description: {full_expense_details['description']}\n"
-                         f"Date: {logged_date_obj.strftime('%Y-%m-%d (%A)')}"
-                )
-                
-                feedback_payload = {
-                    "telegramChatId": full_expense_details["telegramChatId"],
-                    "original_text_for_ai": full_expense_details.get("original_text_for_ai", "N/A"),
-                    "ai_predicted_category": full_expense_details.get("ai_suggested_category"), 
-                    "ai_confidence": full_expense_details.get("ai_confidence"), 
-                    "user_chosen_category": full_expense_details["category"], 
-                }
-                try:
-                    feedback_result = convex_client.mutation("feedback_mutations:recordCategoryFeedback", feedback_payload)
-                    if feedback_result and feedback_result.get("success"):
-                        logger.info(f"Category feedback recorded successfully for log_attempt_key {log_attempt_key}.")
-                    else:
-                        logger.warning(f"Failed to record category feedback for log_attempt_key {log_attempt_key}. Result: {feedback_result}")
-                except Exception as fb_e:
-                    logger.error(f"Error calling Convex recordCategoryFeedback mutation: {fb_e}")
-
-            else: 
-                error_msg = log_result.get("error", "Failed to log expense.") if log_result else "Failed to log expense (no response)."
-                await query.edit_message_text(text=f"⚠️ Error logging expense: {error_msg}")
-        except Exception as e: 
-            logger.error(f"Error calling Convex expenses:logExpense mutation after final confirmation: {e}")
-            await query.edit_message_text(text=f"⚠️ An error occurred while logging your expense: {str(e)}")
-    
-    elif action == "no":
-        logger.info(f"User cancelled FINAL logging for key {log_attempt_key}.")
-        await query.edit_message_text(text="Logging cancelled. Feel free to try again with /log.")
-    else:
-        logger.warning(f"Unknown action in final log confirmation callback: {callback_data_full}")
-        await query.edit_message_text(text="Sorry, I didn't understand that action.")
 
+_CALLBACK_DISPATCH = {
+    CAT_OVERRIDE_CODE: _on_category_override,
+    CAT_CANCEL_LOG_CODE: _on_cancel_log,
+    LOG_CONFIRM_YES_CODE: _on_log_yes,
+    LOG_CONFIRM_NO_CODE: _on_log_no,
+}
@@ -1,16 +1,36 @@
 # handlers/query_handlers.py
+import asyncio
 import logging
 import re # Though not heavily used here, kept for consistency if minor parsing added
-from datetime import datetime, timezone, date # Added date
-import calendar
-from typing import Optional
+import time
+from typing import Any, Dict, Optional
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from utils.parsing_utils import parse_period_to_date_range # Assuming this doesn't need nlp for now for these
+from services.convex_service import reply_then_await, run_convex_query
+from utils.parsing_utils import format_display_period, parse_period_to_date_range # Assuming this doesn't need nlp for now for these
 
 logger = logging.getLogger(__name__)
 
+_CATEGORY_LOOKUP_BOT_DATA_KEY = "_category_name_lookup"
+
+def _category_name_lookup(bot_data: Dict[str, Any], predefined_categories: dict) -> Dict[str, str]:
+    """Lowercased category name -> name as defined, computed once and kept in bot_data."""
+    lookup = bot_data.get(_CATEGORY_LOOKUP_BOT_DATA_KEY)
+    if lookup is None:
+        lookup = {}
+        for cat_name_key in predefined_categories.keys():
+            lookup.setdefault(cat_name_key.lower(), cat_name_key)
+        bot_data[_CATEGORY_LOOKUP_BOT_DATA_KEY] = lookup
+    return lookup
+
+_WEEKDAY_ABBREVIATIONS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+def _format_expense_day(timestamp_ms: float) -> str:
+    """UTC "YYYY-MM-DD (Ddd)" for the /details list, from time.gmtime instead of building a datetime per row."""
+    t = time.gmtime(timestamp_ms / 1000)
+    return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d} ({_WEEKDAY_ABBREVIATIONS[t.tm_wday]})"
+
 async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
                           convex_client: any, nlp_processor: any) -> None: # nlp_processor kept for parse_period
     telegram_chat_id = str(update.message.from_user.id)
@@ -36,33 +56,23 @@ async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
     
     if not found_known_period:
         parts = args_str.split() 
+        default_range = parse_period_to_date_range("this month", nlp_processor)
+
+        def is_period(candidate: str) -> bool:
+            # Anything that falls back to the "this month" default (other than saying so) is not a period
+            return candidate.lower() == "this month" or parse_period_to_date_range(candidate, nlp_processor) != default_range
+
         if not parts:
             period_str = "this month"
-        elif len(parts) == 1:
-            parsed_start, parsed_end = parse_period_to_date_range(parts[0], nlp_processor)
-            default_start, default_end = parse_period_to_date_range("this month", nlp_processor)
-            if parsed_start == default_start and parsed_end == default_end and parts[0].lower() != "this month":
-                 category = parts[0]
-                 period_str = "this month"
-            else:
-                 period_str = parts[0]
+        elif len(parts) > 1 and is_period(" ".join(parts[-2:])):
+            period_str = " ".join(parts[-2:])
+            category = " ".join(parts[:-2]).strip() or None
+        elif is_period(parts[-1]):
+            period_str = parts[-1]
+            category = " ".join(parts[:-1]).strip() or None
         else: 
-            potential_period_2_words = " ".join(parts[-2:])
-            parsed_start_2, parsed_end_2 = parse_period_to_date_range(potential_period_2_words, nlp_processor)
-            default_start, default_end = parse_period_to_date_range("this month", nlp_processor)
-
-            if not (parsed_start_2 == default_start and parsed_end_2 == default_end and potential_period_2_words.lower() != "this month"):
-                period_str = potential_period_2_words
-                category = " ".join(parts[:-2]).strip() if len(parts[:-2]) > 0 else None
-            else: 
-                potential_period_1_word = parts[-1]
-                parsed_start_1, parsed_end_1 = parse_period_to_date_range(potential_period_1_word, nlp_processor)
-                if not (parsed_start_1 == default_start and parsed_end_1 == default_end and potential_period_1_word.lower() != "this month"):
-                    period_str = potential_period_1_word
-                    category = " ".join(parts[:-1]).strip() if len(parts[:-1]) > 0 else None
-                else: 
-                    category = " ".join(parts).strip()
-                    period_str = "this month"
+            category = " ".join(parts).strip()
+            period_str = "this month"
     
     if not period_str: 
         period_str = "this month"
@@ -73,18 +83,7 @@ async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
     start_timestamp_ms, end_timestamp_ms = parse_period_to_date_range(period_str, nlp_processor)
     
-    display_period_start_dt = datetime.fromtimestamp(start_timestamp_ms/1000)
-    display_period_end_dt = datetime.fromtimestamp(end_timestamp_ms/1000)
-    
-    display_period = f"{display_period_start_dt.strftime('%b %d, %Y')} to {display_period_end_dt.strftime('%b %d, %Y')}"
-    if period_str:
-        if period_str.lower() == "this month":
-            display_period = f"This Month ({display_period_start_dt.strftime('%B %Y')})"
-        elif period_str.lower() == "last month":
-            display_period = f"Last Month ({display_period_start_dt.strftime('%B %Y')})"
-        elif display_period_start_dt.day == 1 and \
-             (lambda y, m: hasattr(calendar, 'monthrange') and display_period_end_dt.day == calendar.monthrange(y, m)[1])(display_period_end_dt.year, display_period_end_dt.month):
-            display_period = display_period_start_dt.strftime("%B %Y")
+    display_period = format_display_period(period_str, start_timestamp_ms, end_timestamp_ms)
 
     query_args = {
         "telegramChatId": telegram_chat_id,
@@ -94,10 +93,13 @@ async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
     if category:
         query_args["category"] = category.strip()
 
-    await update.message.reply_text(f"Fetching summary for {display_period}" + (f" in category '{category.strip()}'..." if category else "..."))
-
+    # The query runs while the "Fetching..." reply is being sent
     try:
-        summary_result = convex_client.query("queries:getExpenseSummary", query_args)
+        summary_result = await reply_then_await(
+            update.message,
+            f"Fetching summary for {display_period}" + (f" in category '{category.strip()}'..." if category else "..."),
+            run_convex_query(convex_client, "queries:getExpenseSummary", query_args),
+        )
         
         if summary_result:
             count = summary_result.get("count", 0)
@@ -112,6 +114,9 @@ async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
             await update.message.reply_text(response_message)
         else:
             await update.message.reply_text("Could not retrieve summary. No data found or an error occurred.")
+    except asyncio.TimeoutError:
+        logger.warning("Convex getExpenseSummary query timed out for user %s", telegram_chat_id)
+        await update.message.reply_text("⏳ The server is taking too long to answer right now. Please try /summary again in a moment.")
     except Exception as e:
         logger.error(f"Error calling Convex getExpenseSummary query: {e}")
         if "Function not found" in str(e):
@@ -139,38 +144,44 @@ async def details_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
             pass 
     
     logger.info(f"User {telegram_chat_id} requested /details with limit: {limit}")
-    await update.message.reply_text(f"Fetching your last {limit} expenses...")
-
+    query_args = {"telegramChatId": telegram_chat_id, "limit": limit}
     try:
-        query_args = {"telegramChatId": telegram_chat_id, "limit": limit}
-        recent_expenses = convex_client.query("queries:getRecentExpenses", query_args)
+        recent_expenses = await reply_then_await(
+            update.message,
+            f"Fetching your last {limit} expenses...",
+            run_convex_query(convex_client, "queries:getRecentExpenses", query_args),
+        )
 
         if recent_expenses:
             if not recent_expenses: 
                 await update.message.reply_text("You have no expenses logged yet.")
                 return
 
-            response_message = f"📜 Your Last {len(recent_expenses)} Expenses:\n"
-            response_message += "------------------------------------\n"
+            response_parts = [
+                f"📜 Your Last {len(recent_expenses)} Expenses:\n",
+                "------------------------------------\n",
+            ]
             for expense in recent_expenses:
                 try:
-                    expense_date_obj = datetime.fromtimestamp(expense['date'] / 1000, tz=timezone.utc)
-                    expense_date_str = expense_date_obj.strftime('%Y-%m-%d (%a)')
+                    expense_date_str = _format_expense_day(expense['date'])
                 except (TypeError, ValueError): 
                     expense_date_str = "N/A"
                 
                 desc = expense.get('description', 'N/A') or "N/A" 
                 
-                response_message += (
+                response_parts.append(
                     f"🗓️ Date: {expense_date_str}\n"
                     f"💰 Amount: ${expense['amount']:.2f}\n"
                     f"🏷️ Category: {expense['category']}\n"
                     f"📝 Desc: {desc}\n"
                     f"------------------------------------\n"
                 )
-            await update.message.reply_text(response_message)
+            await update.message.reply_text("".join(response_parts))
         else: 
             await update.message.reply_text("Could not retrieve recent expenses. No data found or an error occurred.")
+    except asyncio.TimeoutError:
+        logger.warning("Convex getRecentExpenses query timed out for user %s", telegram_chat_id)
+        await update.message.reply_text("⏳ The server is taking too long to answer right now. Please try /details again in a moment.")
     except Exception as e:
         logger.error(f"Error calling Convex getRecentExpenses query: {e}")
         if "Limit must be between 1 and 50" in str(e): 
@@ -202,19 +213,14 @@ async def category_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
     
     words = args_text.split()
     current_best_match_category = None
-    longest_match_len = 0
     remaining_words_for_period = list(words) # Make a mutable copy
+    category_lookup = _category_name_lookup(context.bot_data, predefined_categories)
 
     for i in range(len(words), 0, -1): # Check for longer phrases first
-        potential_cat_phrase = " ".join(words[:i]).lower()
-        for cat_name_key in predefined_categories.keys(): # Iterate over defined category names
-            if cat_name_key.lower() == potential_cat_phrase:
-                if len(potential_cat_phrase) > longest_match_len: # Found a predefined category name
-                    current_best_match_category = cat_name_key # Use the actual casing
-                    longest_match_len = len(potential_cat_phrase)
-                    remaining_words_for_period = words[i:]
-                    break # Found the best match for this length
-        if current_best_match_category: # If a match was found for this phrase length, stop.
+        matched_category = category_lookup.get(" ".join(words[:i]).lower())
+        if matched_category: # Found a predefined category name; use the actual casing
+            current_best_match_category = matched_category
+            remaining_words_for_period = words[i:]
             break
             
     if current_best_match_category:
@@ -240,18 +246,7 @@ async def category_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
     start_timestamp_ms, end_timestamp_ms = parse_period_to_date_range(period_str, nlp_processor)
     
-    display_period_start_dt = datetime.fromtimestamp(start_timestamp_ms/1000)
-    display_period_end_dt = datetime.fromtimestamp(end_timestamp_ms/1000)
-    
-    display_period = f"{display_period_start_dt.strftime('%b %d, %Y')} to {display_period_end_dt.strftime('%b %d, %Y')}"
-    if period_str:
-        if period_str.lower() == "this month":
-            display_period = f"This Month ({display_period_start_dt.strftime('%B %Y')})"
-        elif period_str.lower() == "last month":
-            display_period = f"Last Month ({display_period_start_dt.strftime('%B %Y')})"
-        elif display_period_start_dt.day == 1 and \
-             (lambda y, m: hasattr(calendar, 'monthrange') and display_period_end_dt.day == calendar.monthrange(y, m)[1])(display_period_end_dt.year, display_period_end_dt.month):
-            display_period = display_period_start_dt.strftime("%B %Y")
+    display_period = format_display_period(period_str, start_timestamp_ms, end_timestamp_ms)
 
     query_args = {
         "telegramChatId": telegram_chat_id,
@@ -260,10 +255,12 @@ async def category_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
         "category": target_category.strip(),
     }
 
-    await update.message.reply_text(f"Fetching summary for category '{target_category.strip()}' in {display_period}...")
-
     try:
-        summary_result = convex_client.query("queries:getExpenseSummary", query_args)
+        summary_result = await reply_then_await(
+            update.message,
+            f"Fetching summary for category '{target_category.strip()}' in {display_period}...",
+            run_convex_query(convex_client, "queries:getExpenseSummary", query_args),
+        )
         
         if summary_result:
             count = summary_result.get("count", 0)
@@ -281,6 +278,9 @@ async def category_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
             await update.message.reply_text(response_message)
         else:
             await update.message.reply_text("Could not retrieve summary. No data found or an error occurred.")
+    except asyncio.TimeoutError:
+        logger.warning("Convex getExpenseSummary query for /category timed out for user %s", telegram_chat_id)
+        await update.message.reply_text("⏳ The server is taking too long to answer right now. Please try /category again in a moment.")
     except Exception as e:
         logger.error(f"Error calling Convex getExpenseSummary query for /category: {e}")
         if "User not found" in str(e):
@@ -1,8 +1,11 @@
 # handlers/registration_handler.py
+import asyncio
 import logging
 from telegram import Update, ReplyKeyboardRemove
 from telegram.ext import ContextTypes, ConversationHandler
 
+from services.convex_service import run_convex_mutation
+
 # These will be imported from bot.py or a config module
 # For now, assume they are accessible or passed if needed.
 # from bot import convex_client, logger # Example if importing directly
@@ -58,7 +61,8 @@ async def received_password(update: Update, context: ContextTypes.DEFAULT_TYPE,
     await update.message.reply_text("Attempting to register you... Please wait.")
 
     try:
-        result = convex_client.mutation(
+        result = await run_convex_mutation(
+            convex_client,
             "auth:registerUser",
             {
                 "username": username,
@@ -76,6 +80,14 @@ async def received_password(update: Update, context: ContextTypes.DEFAULT_TYPE,
         else:
             error_message = result.get("error", "Registration failed. Please try again.")
             await update.message.reply_text(error_message)
+    except asyncio.TimeoutError:
+        # The mutation keeps running in the Convex worker and may still commit
+        logger.warning(f"Convex registration for {username} timed out; it may still complete.")
+        await update.message.reply_text(
+            "Registration is taking longer than expected and may already have gone through. "
+            f"Please wait a moment, then run /start again with the username '{username}': "
+            "if it's reported as already taken, you are registered."
+        )
     except Exception as e:
         logger.error(f"Error during Convex registration for {username}: {e}")
         if "Username already taken" in str(e):
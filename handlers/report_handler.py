@@ -1,17 +1,25 @@
 # handlers/report_handler.py
+import asyncio
 import logging
-import csv
-import io # For creating CSV in memory
+import re
 from datetime import datetime, timezone
 from typing import Optional
 from telegram import Update, InputFile
 from telegram.ext import ContextTypes
 
+from services.convex_service import reply_then_await, run_convex_query
 # Assuming parse_period_to_date_range is in parsing_utils
 from utils.parsing_utils import parse_period_to_date_range
 
 logger = logging.getLogger(__name__)
 
+# Anything but letters, digits, '-' and '_' is dropped from report filenames
+_FILENAME_UNSAFE_CHARS_RE = re.compile(r'[^\w-]+')
+
+# A whole period's expenses can take longer to read than the default Convex call budget
+REPORT_QUERY_TIMEOUT_SECONDS = 30.0
+
+
 async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
                          convex_client: any, nlp_processor: any) -> None:
     """Handles the /report command to generate and send a CSV report of expenses."""
@@ -44,57 +52,32 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
         filename_period_str = period_str_arg.replace(" ", "_").replace("/", "-") if period_str_arg else display_period_start_dt.strftime("%Y-%m-%d") + "_to_" + display_period_end_dt.strftime("%Y-%m-%d")
     
     # Sanitize filename_period_str further if needed (remove special chars not good for filenames)
-    filename_period_str = "".join(c if c.isalnum() or c in ['-', '_'] else '' for c in filename_period_str)
+    filename_period_str = _FILENAME_UNSAFE_CHARS_RE.sub('', filename_period_str)
 
 
-    await update.message.reply_text(f"Generating your expense report for {period_str_arg}...")
-
+    query_args = {
+        "telegramChatId": telegram_chat_id,
+        "startDate": start_timestamp_ms,
+        "endDate": end_timestamp_ms,
+    }
+    # The query runs while the "Generating..." reply is being sent
     try:
-        query_args = {
-            "telegramChatId": telegram_chat_id,
-            "startDate": start_timestamp_ms,
-            "endDate": end_timestamp_ms,
-        }
-        expenses_for_report = convex_client.query("queries:getExpensesForReport", query_args)
+        # The CSV is built server-side, so the bot only uploads it
+        report = await reply_then_await(
+            update.message,
+            f"Generating your expense report for {period_str_arg}...",
+            run_convex_query(convex_client, "queries:getExpenseReportCSV", query_args,
+                             timeout=REPORT_QUERY_TIMEOUT_SECONDS),
+        )
 
-        if not expenses_for_report:
+        if not report or not report.get("rowCount"):
             await update.message.reply_text(f"No expenses found for the period: {period_str_arg}.")
             return
 
-        # Create CSV in memory
-        output = io.StringIO()
-        csv_writer = csv.writer(output)
-        
-        # Write header row
-        csv_writer.writerow(['Date', 'Category', 'Amount', 'Description'])
-        
-        # Write data rows
-        for expense in expenses_for_report:
-            try:
-                # Convert timestamp (milliseconds) to human-readable date
-                expense_date_str = datetime.fromtimestamp(expense['date'] / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
-            except (TypeError, ValueError):
-                expense_date_str = "N/A" # Should not happen if data is clean
-            
-            csv_writer.writerow([
-                expense_date_str,
-                expense['category'],
-                f"{expense['amount']:.2f}", # Format amount as string with 2 decimal places
-                expense.get('description', '') # Use .get for description, default to empty string
-            ])
-        
-        # Get CSV content from StringIO object
-        csv_content = output.getvalue()
-        output.close()
-        
-        # Send the CSV file
-        # Convert string to bytes for InputFile
-        csv_bytes = csv_content.encode('utf-8')
-        
         # Create a filename for the report
         report_filename = f"expense_report_{filename_period_str}.csv"
         
-        input_file = InputFile(io.BytesIO(csv_bytes), filename=report_filename)
+        input_file = InputFile(report["csv"].encode('utf-8'), filename=report_filename)
         
         await context.bot.send_document(
             chat_id=update.effective_chat.id,
@@ -103,6 +86,9 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
         )
         logger.info(f"Sent CSV report to user {telegram_chat_id} for period '{period_str_arg}'")
 
+    except asyncio.TimeoutError:
+        logger.warning("Convex getExpenseReportCSV query timed out for user %s", telegram_chat_id)
+        await update.message.reply_text("⏳ The server is taking too long to answer right now. Please try /report again in a moment.")
     except Exception as e:
         logger.error(f"Error generating or sending report for user {telegram_chat_id}: {e}")
         if "User not found" in str(e):
@@ -1,14 +1,117 @@
 # services/ai_categorization_service.py
+import asyncio
 import logging
 import json
-from typing import Optional, Tuple
-import requests
+import string
+from typing import Any, Dict, List, Optional, Set, Tuple
+import httpx
+from cachetools import TTLCache
+try:
+    import orjson  # Optional: faster (de)serialization for the AI service payloads
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
-def get_ai_category_prediction(text_to_predict: str, ai_service_url: str) -> Tuple[Optional[str], Optional[float]]:
+# Words and punctuation that don't change the category; dropped from cache keys so
+# "coffee at Starbucks" and "Coffee, starbucks!" share an entry
+_CACHE_KEY_STOPWORDS = frozenset({
+    "a", "an", "the", "at", "on", "in", "for", "from", "to", "of", "with", "and", "my", "some",
+})
+_CACHE_KEY_PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+# Successful predictions keyed by (normalized text, service url). Entries expire so
+# retrained models are picked up; only touched from the event loop, so no lock is needed.
+_PREDICTION_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+_CACHE_STATS_LOG_INTERVAL = 100
+_cache_hits = 0
+_cache_misses = 0
+
+# One pooled client for all AI calls so keep-alive connections are reused across messages
+AI_REQUEST_TIMEOUT_SECONDS = 10.0
+# Fail fast when the service is unreachable instead of spending the whole budget on connect
+AI_CONNECT_TIMEOUT_SECONDS = 3.0
+_http_client: Optional[httpx.AsyncClient] = None
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(AI_REQUEST_TIMEOUT_SECONDS, connect=AI_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+        )
+    return _http_client
+
+async def close_ai_http_client() -> None:
+    """Closes the pooled AI service client; call once on shutdown."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# A cache miss is sent right away when no request to its service is outstanding. Misses that
+# arrive while one is in flight are queued and sent together as one /predict_category_batch
+# request when it finishes (or as soon as AI_BATCH_MAX_SIZE are queued), so batching only
+# happens under load and never delays a lone message.
+AI_BATCH_MAX_SIZE = 16
+_pending_batches: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+_batches_in_flight: Dict[str, int] = {}
+_batch_background_tasks: Set[asyncio.Task] = set()
+# Service URLs whose deployment has no batch endpoint; they get concurrent single calls instead
+_batch_unsupported_urls: Set[str] = set()
+
+_JSON_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+
+def _dumps_json(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode()
+
+def _loads_json(content: bytes) -> Any:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch either
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def _normalize_description(text: str) -> str:
+    # Punctuation-only descriptions ("?!") keep their raw words rather than an empty key
+    words = text.lower().translate(_CACHE_KEY_PUNCTUATION_TABLE).split() or text.lower().split()
+    key_words = [word for word in words if word not in _CACHE_KEY_STOPWORDS]
+    return " ".join(key_words or words)
+
+def clear_prediction_cache() -> None:
+    """Drops all cached AI predictions (e.g. after the model has been retrained)."""
+    global _cache_hits, _cache_misses
+    _PREDICTION_CACHE.clear()
+    _cache_hits = _cache_misses = 0
+    logger.info("AI prediction cache cleared.")
+
+def invalidate_cached_prediction(text_to_predict: str) -> None:
     """
-    Calls the external AI service to get a category prediction.
+    Drops the cached prediction for this description (for every service URL), e.g. after the
+    user overrode it, so the next request asks the possibly retrained model again.
+    """
+    normalized = _normalize_description(text_to_predict)
+    stale_keys = [key for key in _PREDICTION_CACHE.keys() if key[0] == normalized]
+    for key in stale_keys:
+        _PREDICTION_CACHE.pop(key, None)
+    if stale_keys:
+        logger.info("Invalidated cached AI prediction for '%s'.", normalized)
+
+def _record_cache_lookup(hit: bool) -> None:
+    global _cache_hits, _cache_misses
+    if hit:
+        _cache_hits += 1
+    else:
+        _cache_misses += 1
+    total = _cache_hits + _cache_misses
+    if total % _CACHE_STATS_LOG_INTERVAL == 0:
+        logger.info("AI prediction cache stats: hits=%s, misses=%s, size=%s", _cache_hits, _cache_misses, len(_PREDICTION_CACHE))
+
+async def get_ai_category_prediction(text_to_predict: str, ai_service_url: str) -> Tuple[Optional[str], Optional[float]]:
+    """
+    Returns the AI category prediction for text_to_predict, served from an in-memory
+    TTL cache when the same (normalized) description was predicted recently.
     Returns:
         Tuple[Optional[str], Optional[float]]: (predicted_category, confidence_score)
                                                 or (None, None) if an error occurs or no prediction.
@@ -17,41 +120,148 @@ def get_ai_category_prediction(text_to_predict: str, ai_service_url: str) -> Tup
         logger.warning("Text for AI prediction is empty or whitespace only. Returning None.")
         return None, 0.0  # Return 0 confidence for empty/whitespace text
 
+    cache_key = (_normalize_description(text_to_predict), ai_service_url)
+    cached_prediction = _PREDICTION_CACHE.get(cache_key)
+    _record_cache_lookup(cached_prediction is not None)
+    if cached_prediction is not None:
+        logger.debug("AI prediction cache hit for '%s': %s", cache_key[0], cached_prediction)
+        return cached_prediction
+
+    prediction = await _enqueue_prediction(text_to_predict, ai_service_url)
+    if prediction[0] is not None:  # Only cache real predictions, never errors
+        _PREDICTION_CACHE[cache_key] = prediction
+    return prediction
+
+async def _enqueue_prediction(text_to_predict: str, ai_service_url: str) -> Tuple[Optional[str], Optional[float]]:
+    """Adds the text to the pending batch for ai_service_url and waits for its prediction."""
+    future = asyncio.get_running_loop().create_future()
+    batch = _pending_batches.setdefault(ai_service_url, [])
+    batch.append((text_to_predict, future))
+    if not _batches_in_flight.get(ai_service_url) or len(batch) >= AI_BATCH_MAX_SIZE:
+        _flush_batch(ai_service_url)
+    return await future
+
+def _flush_batch(ai_service_url: str) -> None:
+    batch = _pending_batches.pop(ai_service_url, None)
+    if batch:
+        _batches_in_flight[ai_service_url] = _batches_in_flight.get(ai_service_url, 0) + 1
+        task = asyncio.ensure_future(_send_batch(ai_service_url, batch))
+        _batch_background_tasks.add(task)  # Keep a reference until the task is done
+        task.add_done_callback(_batch_background_tasks.discard)
+        task.add_done_callback(lambda _: _on_batch_done(ai_service_url))
+
+def _on_batch_done(ai_service_url: str) -> None:
+    """Sends whatever queued up while the finished request was in flight."""
+    remaining = _batches_in_flight.get(ai_service_url, 1) - 1
+    if remaining:
+        _batches_in_flight[ai_service_url] = remaining
+    else:
+        _batches_in_flight.pop(ai_service_url, None)
+    _flush_batch(ai_service_url)
+
+async def _send_batch(ai_service_url: str, batch: List[Tuple[str, asyncio.Future]]) -> None:
+    texts = [text for text, _ in batch]
+    predictions = None
+    try:
+        if len(texts) > 1 and ai_service_url not in _batch_unsupported_urls:
+            predictions = await _request_ai_category_batch(texts, ai_service_url)
+        if predictions is None:
+            predictions = await asyncio.gather(*(_request_ai_category_prediction(text, ai_service_url) for text in texts))
+    except Exception as e:
+        logger.error("Unexpected error while sending AI prediction batch: %s", e, exc_info=True)
+        predictions = [(None, None)] * len(batch)
+    for (_, future), prediction in zip(batch, predictions):
+        if not future.done():  # The waiting handler may have been cancelled
+            future.set_result(prediction)
+
+def _parse_prediction(data: Any) -> Tuple[Optional[str], Optional[float]]:
+    """Validates one {"predicted_category", "confidence"} object from the AI service."""
+    if not isinstance(data, dict):
+        logger.warning("AI service returned a non-object prediction: %s", data)
+        return None, None
+    predicted_category = data.get("predicted_category")
+    confidence = data.get("confidence")
+
+    # Basic validation of response
+    if predicted_category is None or confidence is None:
+        logger.warning("AI service response missing 'predicted_category' or 'confidence'. Response: %s", data)
+        return None, None
+    if not isinstance(predicted_category, str) or not isinstance(confidence, (float, int)):
+        logger.warning("AI service returned unexpected types. Category: %s, Conf: %s", type(predicted_category), type(confidence))
+        return None, None # Or attempt conversion if safe
+
+    logger.info("AI Service Response: Category='%s', Confidence=%s", predicted_category, confidence)
+    return predicted_category, float(confidence) # Ensure confidence is float
+
+async def _request_ai_category_batch(texts: List[str], ai_service_url: str) -> Optional[List[Tuple[Optional[str], Optional[float]]]]:
+    """
+    Calls the AI service batch endpoint with several descriptions at once.
+    Returns:
+        One (predicted_category, confidence_score) per text, or None if the batch call failed
+        for any reason (the caller then falls back to single requests). Only a 404/405 marks
+        the service as having no batch endpoint at all.
+    """
+    endpoint = f"{ai_service_url.rstrip('/')}/predict_category_batch"
+
+    try:
+        logger.info("Calling AI batch endpoint at %s with %s texts", endpoint, len(texts))
+        response = await _get_http_client().post(endpoint, content=_dumps_json({"texts": texts}), headers=_JSON_HEADERS)
+        if response.status_code in (404, 405):
+            logger.warning("AI service at %s has no batch endpoint; using single requests from now on.", ai_service_url)
+            _batch_unsupported_urls.add(ai_service_url)
+            return None
+        response.raise_for_status()
+
+        predictions = _loads_json(response.content).get("predictions")
+        if not isinstance(predictions, list) or len(predictions) != len(texts):
+            logger.warning("AI batch response does not match the %s texts sent. Response: %s", len(texts), response.text)
+            return None
+        return [_parse_prediction(item) for item in predictions]
+
+    except httpx.TimeoutException:
+        logger.error("Timeout calling AI batch endpoint at %s; falling back to single requests.", endpoint)
+        return None
+    except httpx.HTTPStatusError as http_err:
+        logger.error("HTTP error calling AI batch endpoint at %s: %s; falling back to single requests. Response: %s",
+                     endpoint, http_err, http_err.response.text)
+        return None
+    except httpx.HTTPError as req_err:
+        logger.error("Request exception calling AI batch endpoint at %s: %s; falling back to single requests.", endpoint, req_err)
+        return None
+    except (json.JSONDecodeError, AttributeError) as json_err:
+        logger.error("Error decoding JSON batch response from AI service: %s; falling back to single requests.", json_err)
+        return None
+
+async def _request_ai_category_prediction(text_to_predict: str, ai_service_url: str) -> Tuple[Optional[str], Optional[float]]:
+    """
+    Calls the external AI service to get a category prediction.
+    Returns:
+        Tuple[Optional[str], Optional[float]]: (predicted_category, confidence_score)
+                                                or (None, None) if an error occurs or no prediction.
+    """
     endpoint = f"{ai_service_url.rstrip('/')}/predict_category"
     payload = {"text": text_to_predict}
     
     try:
-        logger.info(f"Calling AI service at {endpoint} with payload: {payload}")
-        response = requests.post(endpoint, json=payload, timeout=10)  # Added timeout
+        logger.info("Calling AI service at %s", endpoint)
+        logger.debug("AI service payload: %s", payload)
+        response = await _get_http_client().post(endpoint, content=_dumps_json(payload), headers=_JSON_HEADERS)
         response.raise_for_status()  # Raise HTTPError for bad responses (4XX or 5XX)
         
-        data = response.json()
-        predicted_category = data.get("predicted_category")
-        confidence = data.get("confidence")
-        
-        # Basic validation of response
-        if predicted_category is None or confidence is None:
-            logger.warning(f"AI service response missing 'predicted_category' or 'confidence'. Response: {data}")
-            return None, None
-        if not isinstance(predicted_category, str) or not isinstance(confidence, (float, int)):
-            logger.warning(f"AI service returned unexpected types. Category: {type(predicted_category)}, Conf: {type(confidence)}")
-            return None, None # Or attempt conversion if safe
-
-        logger.info(f"AI Service Response: Category='{predicted_category}', Confidence={confidence}")
-        return predicted_category, float(confidence) # Ensure confidence is float
-
-    except requests.exceptions.Timeout:
-        logger.error(f"Timeout calling AI service at {endpoint}")
+        return _parse_prediction(_loads_json(response.content))
+
+    except httpx.TimeoutException:
+        logger.error("Timeout calling AI service at %s", endpoint)
         return None, None
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP error calling AI service at {endpoint}: {http_err}. Response: {response.text if 'response' in locals() else 'N/A'}")
+    except httpx.HTTPStatusError as http_err:
+        logger.error("HTTP error calling AI service at %s: %s. Response: %s", endpoint, http_err, http_err.response.text)
         return None, None
-    except requests.exceptions.RequestException as req_err:
-        logger.error(f"Request exception calling AI service at {endpoint}: {req_err}")
+    except httpx.HTTPError as req_err:
+        logger.error("Request exception calling AI service at %s: %s", endpoint, req_err)
         return None, None
     except json.JSONDecodeError as json_err:
-        logger.error(f"Error decoding JSON response from AI service: {json_err}. Response text: {response.text if 'response' in locals() else 'N/A'}")
+        logger.error("Error decoding JSON response from AI service: %s. Response text: %s", json_err, response.text if 'response' in locals() else 'N/A')
         return None, None
     except Exception as e:  # Catch any other unexpected errors
-        logger.error(f"Unexpected error during AI service call: {e}", exc_info=True)
+        logger.error("Unexpected error during AI service call: %s", e, exc_info=True)
         return None, None
@@ -0,0 +1,83 @@
+# services/convex_service.py
+import asyncio
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# The Convex Python client is synchronous, so calls are pushed onto a dedicated IO pool
+# instead of blocking the bot's event loop.
+CONVEX_IO_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="convex")
+CONVEX_CALL_TIMEOUT_SECONDS = 5.0
+MAX_CONCURRENT_CONVEX_CALLS_PER_CHAT = 2
+
+# Identical queries already in flight; concurrent duplicates (e.g. a user tapping /summary
+# repeatedly) share one Convex round-trip. Entries are removed as soon as the query finishes.
+_inflight_queries: Dict[Tuple[Any, ...], "asyncio.Future[Any]"] = {}
+
+# Entries disappear once no call for that chat is in flight
+_chat_semaphores: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+def _get_chat_semaphore(telegram_chat_id: str) -> asyncio.Semaphore:
+    semaphore = _chat_semaphores.get(telegram_chat_id)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CONVEX_CALLS_PER_CHAT)
+        _chat_semaphores[telegram_chat_id] = semaphore
+    return semaphore
+
+async def _run_convex_call(client_method: Any, function_name: str, args: Dict[str, Any],
+                           telegram_chat_id: Optional[str], timeout: float) -> Any:
+    loop = asyncio.get_running_loop()
+    semaphore = _get_chat_semaphore(telegram_chat_id or args.get("telegramChatId", ""))
+    async with semaphore:
+        return await asyncio.wait_for(
+            loop.run_in_executor(CONVEX_IO_EXECUTOR, client_method, function_name, args),
+            timeout=timeout,
+        )
+
+async def run_convex_mutation(convex_client: any, function_name: str, args: Dict[str, Any],
+                              telegram_chat_id: Optional[str] = None) -> Any:
+    """
+    Runs convex_client.mutation on the IO pool without blocking the event loop.
+    Calls for the same chat are bounded by a semaphore; raises asyncio.TimeoutError
+    if Convex does not answer within CONVEX_CALL_TIMEOUT_SECONDS. The write itself is not
+    cancelled and may still commit, so callers must not report a timeout as a failed write.
+    """
+    return await _run_convex_call(convex_client.mutation, function_name, args,
+                                  telegram_chat_id, CONVEX_CALL_TIMEOUT_SECONDS)
+
+async def run_convex_query(convex_client: any, function_name: str, args: Dict[str, Any],
+                           telegram_chat_id: Optional[str] = None,
+                           timeout: float = CONVEX_CALL_TIMEOUT_SECONDS) -> Any:
+    """
+    Runs convex_client.query on the IO pool, with the same per-chat bound as run_convex_mutation.
+    Large reads (e.g. full-period reports) can pass a longer timeout. Concurrent calls with the
+    same function and args are coalesced into one request whose result they all receive.
+    """
+    query_key = (id(convex_client), function_name, tuple(sorted(args.items())))
+    query_future = _inflight_queries.get(query_key)
+    if query_future is None:
+        query_future = asyncio.ensure_future(
+            _run_convex_call(convex_client.query, function_name, args, telegram_chat_id, timeout)
+        )
+        _inflight_queries[query_key] = query_future
+        query_future.add_done_callback(lambda _: _inflight_queries.pop(query_key, None))
+    # Shielded so one cancelled caller doesn't cancel the query for the others
+    return await asyncio.shield(query_future)
+
+async def reply_then_await(message: Any, text: str, query_coro: Awaitable[Any]) -> Any:
+    """
+    Starts query_coro (e.g. a run_convex_query call), sends text as a reply to message while it
+    runs, then returns the query's result. If the reply fails, the query is cancelled and awaited
+    before the error propagates, so it is never left running or with an unretrieved exception.
+    """
+    query_task = asyncio.ensure_future(query_coro)
+    try:
+        await message.reply_text(text)
+    except BaseException:
+        query_task.cancel()
+        await asyncio.gather(query_task, return_exceptions=True)
+        raise
+    return await query_task
@@ -0,0 +1,82 @@
+# tests/test_log_processing_utils.py
+# Run from the repo root with: python -m unittest discover -s tests
+import logging
+import unittest
+
+import spacy
+
+from utils.log_processing_utils import extract_amount_from_text, prepare_text_for_ai
+
+logging.disable(logging.CRITICAL)
+
+
+def _make_nlp():
+    """Blank English pipeline with an entity ruler standing in for en_core_web_sm's NER."""
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([
+        {"label": "MONEY", "pattern": [{"TEXT": "$"}, {"LIKE_NUM": True}]},
+        {"label": "MONEY", "pattern": [{"LIKE_NUM": True}, {"LOWER": "dollars"}]},
+        {"label": "DATE", "pattern": [{"LOWER": "yesterday"}]},
+        {"label": "DATE", "pattern": [{"LOWER": "today"}]},
+        {"label": "DATE", "pattern": [{"LOWER": "last"}, {"LOWER": "friday"}]},
+        {"label": "DATE", "pattern": [{"LOWER": "may"}, {"LIKE_NUM": True}]},
+        {"label": "CARDINAL", "pattern": [{"LIKE_NUM": True}]},
+    ])
+    return nlp
+
+
+# (message, expected amount, expected description). The descriptions are what the
+# regex-based prepare_text_for_ai produced before it became a single token walk.
+DESCRIPTION_CASES = [
+    ("spent $20 on coffee yesterday", 20.0, "on coffee"),
+    ("paid 15 for lunch", 15.0, "for lunch"),
+    ("$ 12.50 groceries at Tesco today", 12.5, "groceries at Tesco"),
+    ("bought 3 books for 45 dollars last friday", 3.0, "books for 45 dollars"),
+    ("20", 20.0, "N/A"),
+    ("lunch 12 on May 5", 12.0, "lunch"),
+    ("got  coffee,  tea   for $4 today", 4.0, "coffee, tea"),
+    ("for 10", 10.0, "for"),
+    ("Dinner at Joe's 25 for", 25.0, "Dinner at Joe's"),
+    ("$5 coffee.", 5.0, "coffee."),
+    ("paid $ 7 for Uber today", 7.0, "for Uber"),
+    ("bus 3 bus 3", 3.0, "bus bus 3"),
+    # Lowercasing "İ" lengthens the string, which must not shift the removed span
+    ("İstanbul taxi $20 yesterday", 20.0, "İstanbul taxi"),
+    ("İİ bus 4", 4.0, "İİ bus"),
+    # Only the amount characters are removed from a token, not the whole token
+    ("coffee20 yesterday", 20.0, "coffee"),
+]
+
+
+class PrepareTextForAiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.nlp = _make_nlp()
+
+    def test_descriptions_match_previous_output(self):
+        for text, expected_amount, expected_description in DESCRIPTION_CASES:
+            with self.subTest(text=text):
+                doc = self.nlp(text)
+                amount, _, amount_span = extract_amount_from_text(text, doc)
+                self.assertEqual(amount, expected_amount)
+                self.assertEqual(prepare_text_for_ai(text, doc, amount_span), expected_description)
+
+    def test_amount_span_covers_removal_text(self):
+        for text, _, _ in DESCRIPTION_CASES:
+            with self.subTest(text=text):
+                _, amount_text, (start, end) = extract_amount_from_text(text, self.nlp(text))
+                self.assertEqual(text[start:end], amount_text)
+
+    def test_removes_the_amount_that_was_parsed(self):
+        # "20.5 dollars" is not a parseable MONEY entity, so the amount is the later CARDINAL;
+        # that occurrence is the one removed, not the first matching text
+        text = "Tesco 20.5 dollars 20.5"
+        doc = self.nlp(text)
+        amount, _, amount_span = extract_amount_from_text(text, doc)
+        self.assertEqual(amount, 20.5)
+        self.assertEqual(prepare_text_for_ai(text, doc, amount_span), "Tesco 20.5 dollars")
+
+
+if __name__ == "__main__":
+    unittest.main()
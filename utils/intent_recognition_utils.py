@@ -1,7 +1,10 @@
 # utils/intent_recognition_utils.py
+import functools
 import logging
+import re
 from typing import Optional, Any # For nlp_processor type
 from spacy.tokens import Doc # For type hinting spaCy Doc
+from utils.nlp_cache import get_cached_doc
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +25,12 @@ QUERY_KEYWORDS = [
     "how much", "show me", "what did i spend", "summary", "details", "report", "category spending"
 ]
 
+# Each keyword list as one alternation, so the lowercased text is scanned once per list
+# instead of once per keyword
+_LOGGING_KEYWORD_RE = re.compile("|".join(map(re.escape, LOGGING_KEYWORDS)))
+_LOGGING_KEYWORD_SET = frozenset(LOGGING_KEYWORDS)
+_QUERY_KEYWORD_RE = re.compile("|".join(map(re.escape, QUERY_KEYWORDS)))
+
 def get_message_intent(text: str, nlp_processor: Any) -> str:
     """
     Analyzes the raw message text to determine user intent.
@@ -31,8 +40,18 @@ def get_message_intent(text: str, nlp_processor: Any) -> str:
     if not text or not text.strip():
         return INTENT_UNKNOWN
 
+    intent = _intent_for_text(text, nlp_processor)
+    logger.info("Intent recognized for '%s': %s", text, intent)
+    return intent
+
+# The intent only depends on the text, and the same short messages repeat often
+@functools.lru_cache(maxsize=4096)
+def _intent_for_text(text: str, nlp_processor: Any) -> str:
+    # The original-case text is parsed (NER is case-sensitive), and the cached Doc is the one
+    # the log path then reuses for amount/date extraction instead of parsing the message again.
+    # Keyword checks below work on lowercased lemmas/text.
+    doc: Doc = get_cached_doc(nlp_processor, text) # Process with spaCy (cached)
     text_lower = text.lower()
-    doc: Doc = nlp_processor(text_lower) # Process with spaCy
 
     # --- Heuristic 1: Presence of monetary amounts ---
     has_money_entity = any(ent.label_ == "MONEY" for ent in doc.ents)
@@ -40,52 +59,53 @@ def get_message_intent(text: str, nlp_processor: Any) -> str:
     # Be careful not to misinterpret cardinals in dates or other contexts.
     has_potential_amount_cardinal = False
     if not has_money_entity:
+        # DATE spans collected once rather than rescanning every entity per CARDINAL
+        date_spans = [(date_ent.start_char, date_ent.end_char) for date_ent in doc.ents if date_ent.label_ == "DATE"]
         for ent in doc.ents:
-            if ent.label_ == "CARDINAL":
-                # Simple check: if the cardinal is just a number and not part of a date entity.
+            # Simple check: if the cardinal is just a number and not part of a date entity.
+            if ent.label_ == "CARDINAL" and ent.text.isdigit():
                 is_part_of_date = any(
-                    date_ent.label_ == "DATE" and ent.start_char >= date_ent.start_char and ent.end_char <= date_ent.end_char
-                    for date_ent in doc.ents
+                    date_start <= ent.start_char and ent.end_char <= date_end
+                    for date_start, date_end in date_spans
                 )
-                if not is_part_of_date and ent.text.isdigit(): # Simple check if it's a number
+                if not is_part_of_date:
                     has_potential_amount_cardinal = True
                     break
     
     has_amount_indicator = has_money_entity or has_potential_amount_cardinal
-    logger.debug(f"Intent check for '{text_lower}': HasAmount={has_amount_indicator} (MONEY: {has_money_entity}, CARDINAL: {has_potential_amount_cardinal})")
+    logger.debug("Intent check for '%s': HasAmount=%s (MONEY: %s, CARDINAL: %s)", text_lower, has_amount_indicator, has_money_entity, has_potential_amount_cardinal)
 
 
     # --- Heuristic 2: Presence of logging keywords ---
     found_logging_keyword = False
     # Check lemmas for better matching
-    lemmatized_tokens = [token.lemma_ for token in doc if not token.is_stop and not token.is_punct]
-    for keyword in LOGGING_KEYWORDS:
-        if keyword in lemmatized_tokens or keyword in text_lower: # Check both lemma and raw text
+    lemmatized_tokens = {token.lemma_.lower() for token in doc if not token.is_stop and not token.is_punct}
+    lemma_keyword_hits = _LOGGING_KEYWORD_SET & lemmatized_tokens
+    if lemma_keyword_hits:
+        found_logging_keyword = True
+        logger.debug("Intent check: Found logging keyword(s) %s", sorted(lemma_keyword_hits))
+    else: # Also check the raw text
+        logging_keyword_match = _LOGGING_KEYWORD_RE.search(text_lower)
+        if logging_keyword_match:
             found_logging_keyword = True
-            logger.debug(f"Intent check: Found logging keyword '{keyword}'")
-            break
+            logger.debug("Intent check: Found logging keyword '%s'", logging_keyword_match.group())
     
     # --- Heuristic 3: Absence of strong query keywords (simple check) ---
     # This is a very basic way to avoid misinterpreting queries as logs.
     # More sophisticated intent classification would be needed for robust differentiation.
-    is_likely_query = False
-    for q_keyword in QUERY_KEYWORDS:
-        if q_keyword in text_lower:
-            is_likely_query = True
-            logger.debug(f"Intent check: Found query keyword '{q_keyword}'")
-            break
+    query_keyword_match = _QUERY_KEYWORD_RE.search(text_lower)
+    is_likely_query = query_keyword_match is not None
+    if is_likely_query:
+        logger.debug("Intent check: Found query keyword '%s'", query_keyword_match.group())
 
     # --- Decision Logic (simple for now) ---
     # If it has an amount and a logging keyword, and isn't clearly a query, assume log.
     if has_amount_indicator and found_logging_keyword and not is_likely_query:
-        logger.info(f"Intent recognized for '{text}': {INTENT_LOG_EXPENSE}")
         return INTENT_LOG_EXPENSE
     
     # If it has an amount but no strong logging keyword, it's ambiguous.
     # For now, we won't treat this as a log unless a keyword is present.
     # Could be refined later (e.g., if it has amount AND date, it's more likely a log).
-
-    logger.info(f"Intent recognized for '{text}': {INTENT_UNKNOWN}")
     return INTENT_UNKNOWN
 
 if __name__ == '__main__':
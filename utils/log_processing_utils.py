@@ -1,4 +1,5 @@
 # utils/log_processing_utils.py
+import bisect
 import logging
 import re
 from typing import Optional, Tuple, List, Any # Added Any for nlp_processor
@@ -6,116 +7,185 @@ from spacy.tokens import Doc # For type hinting spaCy Doc
 
 logger = logging.getLogger(__name__)
 
-def extract_amount_from_text(full_text: str, doc: Doc) -> Tuple[Optional[float], str]:
+# Static patterns compiled once at import instead of on every /log
+_WHITESPACE_RE = re.compile(r'\s+')
+# Whitespace is only consumed after a currency symbol, so a run of spaces without a
+# following digit can't be rescanned from every start position (quadratic on long input)
+_MONEY_FALLBACK_RE = re.compile(r"(?:([\$€£])\s*)?(\d+(?:[\.,]\d+)?)")
+_CURRENCY_CHARS = frozenset("$€£")
+# Currency symbols and thousands separators dropped before float() in one translate pass
+_AMOUNT_STRIP_TABLE = str.maketrans("", "", "$€£,")
+_DIGIT_RE = re.compile(r"\d")
+_AMOUNT_ONLY_RE = re.compile(r"[\$€£]?\s*\d+(?:[\.,]\d+)?")
+# Filler words trimmed from the start/end of a description
+_LEADING_FILLER_WORDS = frozenset({"on", "for", "at", "spent", "buy", "bought", "get", "got", "paid"})
+_TRAILING_FILLER_WORDS = frozenset({"on", "for", "at"})
+
+def _is_within_spans(start: int, end: int, sorted_spans: List[Tuple[int, int]]) -> bool:
+    """True if [start, end) lies inside one of the sorted, non-overlapping spans."""
+    idx = bisect.bisect_right(sorted_spans, (start, float("inf"))) - 1
+    return idx >= 0 and sorted_spans[idx][0] <= start and end <= sorted_spans[idx][1]
+
+def _with_leading_currency(full_text: str, start: int, ent_text: str) -> str:
+    """Prepends a currency symbol directly before start ("$20" or "$ 20") to the entity text."""
+    if _CURRENCY_CHARS.isdisjoint(ent_text):
+        if start > 0 and full_text[start - 1] in _CURRENCY_CHARS:
+            return full_text[start - 1] + ent_text
+        if start > 1 and full_text[start - 2] in _CURRENCY_CHARS and full_text[start - 1].isspace():
+            return full_text[start - 2:start] + ent_text
+    return ent_text
+
+def _parse_positive_amount(amount_text: str) -> Optional[float]:
+    """
+    float() of the cleaned amount text if it is a positive number, otherwise None.
+    Entity text that doesn't start with a digit or '.' ("one", "a dozen") is rejected up
+    front instead of going through the ValueError path; this also keeps out "inf"/"nan".
+    """
+    cleaned = amount_text.translate(_AMOUNT_STRIP_TABLE).strip()
+    if not cleaned or not (cleaned[0].isdigit() or cleaned[0] == "."):
+        return None
+    try:
+        parsed_val = float(cleaned)
+    except ValueError:
+        return None
+    return parsed_val if parsed_val > 0 else None
+
+def _scan_amount(full_text: str) -> Optional[Tuple[float, str, Tuple[int, int]]]:
+    """
+    Single forward scan for the first "[currency] number" in the text (regex fallback).
+    Returns (amount, matched_text, (start, end)) for a positive amount, otherwise None.
+    """
+    money_match = _MONEY_FALLBACK_RE.search(full_text)
+    if not money_match:
+        return None
+    logger.debug("Regex fallback matched (util): '%s'", money_match.group(0))
+    parsed_val = _parse_positive_amount(money_match.group(2))
+    if parsed_val is None:
+        return None
+    return parsed_val, money_match.group(0), money_match.span()
+
+def has_amount_candidate(full_text: str) -> bool:
+    """
+    Cheap pre-check before running spaCy: every amount source (MONEY, CARDINAL, regex
+    fallback) needs at least one digit, so text without digits can't yield an amount.
+    """
+    return _DIGIT_RE.search(full_text) is not None
+
+def extract_amount_only(full_text: str) -> Optional[Tuple[float, str, Tuple[int, int]]]:
+    """
+    Fast path for messages that are nothing but an amount ("20", "$12.50"). These have no
+    description, and no date any of the date formats could match, so spaCy is not needed.
+    Returns (amount, text_for_removal, amount_span), or None if the text has anything else in it.
+    """
+    if not _AMOUNT_ONLY_RE.fullmatch(full_text.strip()):
+        return None
+    return _scan_amount(full_text)
+
+def extract_amount_from_text(full_text: str, doc: Doc) -> Tuple[Optional[float], str, Optional[Tuple[int, int]]]:
     """
     Extracts amount from the full text using spaCy entities and regex fallback.
     Returns:
-        Tuple[Optional[float], str]: (extracted_amount, text_portion_representing_amount_for_removal)
+        Tuple[Optional[float], str, Optional[Tuple[int, int]]]:
+            (extracted_amount, text_portion_representing_amount_for_removal,
+             (start, end) character span of that text in full_text)
     """
     amount: Optional[float] = None
     amount_text_for_removal = ""
     
-    logger.info(f"--- Amount Extraction (util) for: '{full_text}' ---")
-    logger.info(f"spaCy Entities (util): {[(ent.text, ent.label_, ent.start_char, ent.end_char) for ent in doc.ents]}")
+    logger.debug("--- Amount Extraction (util) for: '%s' ---", full_text)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("spaCy Entities (util): %s", [(ent.text, ent.label_, ent.start_char, ent.end_char) for ent in doc.ents])
 
-    # 1. Try MONEY entity
+    # 1. Single pass over the entities: the first parseable MONEY wins outright,
+    #    CARDINALs and DATE spans are collected for the fallback below.
+    cardinal_ents = []
+    date_spans: List[Tuple[int, int]] = []
     for ent in doc.ents:
-        if ent.label_ == "MONEY":
-            logger.info(f"Processing MONEY entity (util): '{ent.text}'")
-            try:
-                cleaned_entity_text = ent.text.replace("$", "").replace("€", "").replace("£", "").replace(",", "").strip()
-                parsed_val = float(cleaned_entity_text)
-                if parsed_val > 0:
-                    amount = parsed_val
-                    potential_removal_text = ent.text
-                    entity_start_char = ent.start_char
-                    if not any(c in potential_removal_text for c in "$€£"):
-                        if entity_start_char > 0 and full_text[entity_start_char - 1] in "$€£":
-                            potential_removal_text = full_text[entity_start_char - 1] + potential_removal_text
-                        elif entity_start_char > 1 and full_text[entity_start_char - 2] in "$€£" and full_text[entity_start_char - 1].isspace():
-                            potential_removal_text = full_text[entity_start_char - 2:entity_start_char] + potential_removal_text
-                    amount_text_for_removal = potential_removal_text
-                    logger.info(f"Amount from MONEY (util): {amount}, Text for removal: '{amount_text_for_removal}'")
-                    return amount, amount_text_for_removal # Return as soon as found
-            except ValueError:
-                logger.warning(f"Could not convert MONEY entity text '{ent.text}' (cleaned: '{cleaned_entity_text}') to float.")
+        label = ent.label_
+        if label == "DATE":
+            date_spans.append((ent.start_char, ent.end_char))
+        elif label == "CARDINAL":
+            cardinal_ents.append(ent)
+        elif label == "MONEY":
+            logger.debug("Processing MONEY entity (util): '%s'", ent.text)
+            parsed_val = _parse_positive_amount(ent.text)
+            if parsed_val is not None:
+                amount = parsed_val
+                amount_text_for_removal = _with_leading_currency(full_text, ent.start_char, ent.text)
+                logger.debug("Amount from MONEY (util): %s, Text for removal: '%s'", amount, amount_text_for_removal)
+                # The removal text ends where the entity does (a currency prefix only extends the start)
+                return amount, amount_text_for_removal, (ent.end_char - len(amount_text_for_removal), ent.end_char)
+            logger.debug("MONEY entity '%s' is not a positive number.", ent.text)
     
-    # 2. If no MONEY, try CARDINAL
-    logger.info("No MONEY entity parsed (util), trying CARDINAL.")
-    for ent in doc.ents:
-        if ent.label_ == "CARDINAL":
-            logger.info(f"Processing CARDINAL entity (util): '{ent.text}'")
-            is_part_of_date = any(
-                date_ent.label_ == "DATE" and ent.start_char >= date_ent.start_char and ent.end_char <= date_ent.end_char
-                for date_ent in doc.ents
-            )
-            if is_part_of_date:
-                logger.info(f"CARDINAL '{ent.text}' is part of a date, skipping.")
-                continue
-            try:
-                cleaned_cardinal_str = ent.text.replace(",", "").strip()
-                parsed_val = float(cleaned_cardinal_str)
-                if parsed_val > 0:
-                    amount = parsed_val
-                    potential_removal_text = ent.text
-                    entity_start_char = ent.start_char
-                    if entity_start_char > 0 and full_text[entity_start_char - 1] in "$€£":
-                        potential_removal_text = full_text[entity_start_char - 1] + potential_removal_text
-                    elif entity_start_char > 1 and full_text[entity_start_char - 2] in "$€£" and full_text[entity_start_char - 1].isspace():
-                         potential_removal_text = full_text[entity_start_char - 2:entity_start_char] + potential_removal_text
-                    amount_text_for_removal = potential_removal_text
-                    logger.info(f"Amount from CARDINAL (util): {amount}, Text for removal: '{amount_text_for_removal}'")
-                    return amount, amount_text_for_removal # Return as soon as found
-            except ValueError:
-                logger.warning(f"Could not convert CARDINAL entity '{ent.text}' to float.")
+    # 2. If no MONEY, try the collected CARDINALs (date_spans is sorted since doc.ents is)
+    logger.debug("No MONEY entity parsed (util), trying CARDINAL.")
+    for ent in cardinal_ents:
+        logger.debug("Processing CARDINAL entity (util): '%s'", ent.text)
+        if _is_within_spans(ent.start_char, ent.end_char, date_spans):
+            logger.debug("CARDINAL '%s' is part of a date, skipping.", ent.text)
+            continue
+        parsed_val = _parse_positive_amount(ent.text)
+        if parsed_val is not None:
+            amount = parsed_val
+            amount_text_for_removal = _with_leading_currency(full_text, ent.start_char, ent.text)
+            logger.debug("Amount from CARDINAL (util): %s, Text for removal: '%s'", amount, amount_text_for_removal)
+            return amount, amount_text_for_removal, (ent.end_char - len(amount_text_for_removal), ent.end_char)
+        logger.debug("CARDINAL entity '%s' is not a positive number.", ent.text)
 
     # 3. Regex fallback if still no amount
-    logger.info("No amount from spaCy MONEY/CARDINAL entities (util), trying regex fallback.")
-    money_match = re.search(r"([\$€£]?)\s*(\d+(?:[\.,]\d+)?(?:\d+)?)", full_text)
-    if money_match:
-        logger.info(f"Regex fallback matched (util): '{money_match.group(0)}'")
-        try:
-            number_part = money_match.group(2)
-            cleaned_amount_str = number_part.replace(",", "").strip()
-            parsed_val = float(cleaned_amount_str)
-            if parsed_val > 0:
-                amount = parsed_val
-                amount_text_for_removal = money_match.group(0).strip()
-                logger.info(f"Amount from REGEX (util): {amount}, Text for removal: '{amount_text_for_removal}'")
-                return amount, amount_text_for_removal # Return
-        except ValueError:
-            logger.warning(f"Could not convert regex-found amount '{money_match.group(0)}' to float.")
+    logger.debug("No amount from spaCy MONEY/CARDINAL entities (util), trying regex fallback.")
+    scanned = _scan_amount(full_text)
+    if scanned is not None:
+        logger.debug("Amount from REGEX (util): %s, Text for removal: '%s'", scanned[0], scanned[1])
+        return scanned
+
+    logger.debug("--- End Amount Extraction (util): Amount=%s, TextForRemoval='%s' ---", amount, amount_text_for_removal)
+    return amount, amount_text_for_removal, None
+
 
-    logger.info(f"--- End Amount Extraction (util): Amount={amount}, TextForRemoval='{amount_text_for_removal}' ---")
-    return amount, amount_text_for_removal
+def _overlaps_any(start: int, end: int, spans: List[Tuple[int, int]]) -> bool:
+    return any(start < span_end and span_start < end for span_start, span_end in spans)
 
+def _text_outside_spans(text: str, start: int, spans: List[Tuple[int, int]]) -> str:
+    """The characters of text (found at offset start) that fall outside every span."""
+    return "".join(
+        char for offset, char in enumerate(text, start)
+        if not any(span_start <= offset < span_end for span_start, span_end in spans)
+    )
 
-def prepare_text_for_ai(full_text: str, doc: Doc, amount_text_to_remove: str) -> str:
+def prepare_text_for_ai(full_text: str, doc: Doc, amount_span: Optional[Tuple[int, int]]) -> str:
     """
     Cleans the full_text by removing amount, date entities, and common keywords
     to prepare it as a description candidate for the AI service.
+    amount_span is the (start, end) span returned by extract_amount_from_text.
+    Works in a single walk over the doc tokens: characters inside the amount span or a
+    DATE entity are dropped (whole tokens if nothing else is left of them), then one
+    leading/trailing filler word is trimmed.
     """
-    text_for_ai = full_text
-    logger.info(f"Initial text for AI/description (util): '{text_for_ai}'")
-
-    if amount_text_to_remove:
-        logger.info(f"Attempting to remove amount text (util): '{amount_text_to_remove}'")
-        escaped_removal_text = re.escape(amount_text_to_remove)
-        text_for_ai = re.sub(escaped_removal_text, '', text_for_ai, 1, flags=re.IGNORECASE)
-        text_for_ai = re.sub(r'\s+', ' ', text_for_ai).strip()
-        logger.info(f"Text after amount removal (util): '{text_for_ai}'")
-    
-    date_entity_texts = [ent.text for ent in doc.ents if ent.label_ == "DATE"]
-    for date_txt in date_entity_texts:
-        logger.info(f"Attempting to remove date text (util): '{date_txt}'")
-        escaped_date = re.escape(date_txt)
-        text_for_ai = re.sub(r'\b' + escaped_date + r'\b', '', text_for_ai, 1, flags=re.IGNORECASE)
-        text_for_ai = re.sub(r'\s+', ' ', text_for_ai).strip()
-        logger.info(f"Text after removing '{date_txt}' (util): '{text_for_ai}'")
-    
-    text_for_ai = re.sub(r'^(on|for|at|spent|buy|bought|get|got|paid)\s+', '', text_for_ai, flags=re.IGNORECASE).strip()
-    text_for_ai = re.sub(r'\s+(on|for|at)$', '', text_for_ai, flags=re.IGNORECASE).strip()
-    text_for_ai = re.sub(r'\s+', ' ', text_for_ai).strip()
-    logger.info(f"Text after keyword/preposition cleanup (util): '{text_for_ai}'")
+    logger.debug("Initial text for AI/description (util): '%s'", full_text)
+
+    skip_spans: List[Tuple[int, int]] = [amount_span] if amount_span else []
+    skip_spans.extend((ent.start_char, ent.end_char) for ent in doc.ents if ent.label_ == "DATE")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Removing amount/date spans (util): %s", [full_text[s:e] for s, e in skip_spans])
+
+    # (token text left after removal, whitespace after the token)
+    kept_parts: List[Tuple[str, str]] = []
+    for token in doc:
+        if token.is_space:
+            continue
+        token_text = token.text
+        if _overlaps_any(token.idx, token.idx + len(token_text), skip_spans):
+            token_text = _text_outside_spans(token_text, token.idx, skip_spans) # e.g. "coffee20" -> "coffee"
+            if not token_text:
+                continue
+        kept_parts.append((token_text, token.whitespace_))
+    if len(kept_parts) > 1 and kept_parts[0][0].lower() in _LEADING_FILLER_WORDS:
+        kept_parts = kept_parts[1:]
+    if len(kept_parts) > 1 and kept_parts[-1][0].lower() in _TRAILING_FILLER_WORDS:
+        kept_parts = kept_parts[:-1]
+
+    text_for_ai = _WHITESPACE_RE.sub(' ', "".join(text + whitespace for text, whitespace in kept_parts)).strip()
+    logger.debug("Text after amount/date/keyword cleanup (util): '%s'", text_for_ai)
     
     return text_for_ai if text_for_ai else "N/A" # Return "N/A" if string becomes empty
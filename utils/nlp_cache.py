@@ -0,0 +1,117 @@
+# utils/nlp_cache.py
+import asyncio
+import logging
+import threading
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional, Set, Tuple
+from cachetools import LRUCache
+from spacy.tokens import Doc # For type hinting spaCy Doc
+
+logger = logging.getLogger(__name__)
+
+# Recently parsed Docs keyed by (pipeline id, disabled pipes, exact text). The exact text is
+# used since NER results depend on casing. Filled from worker threads, hence the lock.
+DOC_CACHE_MAX_SIZE = 2048
+_doc_cache: LRUCache = LRUCache(maxsize=DOC_CACHE_MAX_SIZE)
+_doc_cache_lock = threading.Lock()
+
+# Components not needed when only entities and token text are read (amount, date, description).
+# Names missing from the loaded pipeline are ignored by spaCy.
+NER_ONLY_DISABLED_PIPES: Tuple[str, ...] = ("tagger", "parser", "attribute_ruler", "lemmatizer")
+
+# A text is parsed right away when no parse for the same pipeline/pipes is running. Texts
+# requested while one is running are queued and go through one nlp.pipe() call when it finishes
+# (or as soon as NLP_BATCH_MAX_SIZE are queued), so batching only kicks in under contention.
+NLP_BATCH_MAX_SIZE = 32
+_pending_parses: Dict[Tuple[int, Tuple[str, ...]], List[Tuple[str, asyncio.Future]]] = {}
+_parses_in_flight: Dict[Tuple[int, Tuple[str, ...]], int] = {}
+_parse_background_tasks: Set[asyncio.Task] = set()
+
+def _lookup_doc(nlp_processor: Any, text: str, disable: Tuple[str, ...]) -> Optional[Doc]:
+    with _doc_cache_lock:
+        doc = _doc_cache.get((id(nlp_processor), disable, text))
+        if doc is None and disable:
+            # A full-pipeline Doc has everything a reduced parse would (e.g. intent recognition
+            # already parsed this plain message), so it can stand in for it
+            doc = _doc_cache.get((id(nlp_processor), (), text))
+        return doc
+
+def _store_doc(nlp_processor: Any, text: str, disable: Tuple[str, ...], doc: Doc) -> None:
+    with _doc_cache_lock:
+        _doc_cache[(id(nlp_processor), disable, text)] = doc
+
+def get_cached_doc(nlp_processor: Any, text: str, disable: Tuple[str, ...] = ()) -> Doc:
+    """
+    Returns nlp_processor(text, disable=disable), reusing the Doc if the exact same text was
+    parsed recently with the same components (e.g. a /log message is parsed for the amount and
+    again for the date). Callers must not modify the returned Doc.
+    """
+    doc = _lookup_doc(nlp_processor, text, disable)
+    if doc is None:
+        doc = nlp_processor(text, disable=disable)
+        _store_doc(nlp_processor, text, disable, doc)
+    return doc
+
+async def get_doc_batched(nlp_processor: Any, text: str, executor: Optional[Executor] = None,
+                          disable: Tuple[str, ...] = ()) -> Doc:
+    """
+    Async variant of get_cached_doc: a cache miss is parsed on executor straight away, unless a
+    parse is already running, in which case it is parsed with the other texts that queue up
+    behind it in one nlp_processor.pipe() call.
+    """
+    doc = _lookup_doc(nlp_processor, text, disable)
+    if doc is not None:
+        return doc
+
+    future = asyncio.get_running_loop().create_future()
+    batch_key = (id(nlp_processor), disable)
+    batch = _pending_parses.setdefault(batch_key, [])
+    batch.append((text, future))
+    if not _parses_in_flight.get(batch_key) or len(batch) >= NLP_BATCH_MAX_SIZE:
+        _flush_parses(nlp_processor, disable, executor)
+    return await future
+
+def _flush_parses(nlp_processor: Any, disable: Tuple[str, ...], executor: Optional[Executor]) -> None:
+    batch_key = (id(nlp_processor), disable)
+    batch = _pending_parses.pop(batch_key, None)
+    if batch:
+        _parses_in_flight[batch_key] = _parses_in_flight.get(batch_key, 0) + 1
+        task = asyncio.ensure_future(_run_parse_batch(nlp_processor, disable, batch, executor))
+        _parse_background_tasks.add(task)  # Keep a reference until the task is done
+        task.add_done_callback(_parse_background_tasks.discard)
+        task.add_done_callback(lambda _: _on_parse_batch_done(nlp_processor, disable, executor))
+
+def _on_parse_batch_done(nlp_processor: Any, disable: Tuple[str, ...], executor: Optional[Executor]) -> None:
+    """Parses whatever queued up while the finished batch was running."""
+    batch_key = (id(nlp_processor), disable)
+    remaining = _parses_in_flight.get(batch_key, 1) - 1
+    if remaining:
+        _parses_in_flight[batch_key] = remaining
+    else:
+        _parses_in_flight.pop(batch_key, None)
+    _flush_parses(nlp_processor, disable, executor)
+
+def _parse_texts(nlp_processor: Any, texts: List[str], disable: Tuple[str, ...]) -> Dict[str, Doc]:
+    unique_texts = list(dict.fromkeys(texts))
+    docs = nlp_processor.pipe(unique_texts, batch_size=NLP_BATCH_MAX_SIZE, disable=disable)
+    docs_by_text = dict(zip(unique_texts, docs))
+    for text, doc in docs_by_text.items():
+        _store_doc(nlp_processor, text, disable, doc)
+    return docs_by_text
+
+async def _run_parse_batch(nlp_processor: Any, disable: Tuple[str, ...], batch: List[Tuple[str, asyncio.Future]],
+                           executor: Optional[Executor]) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        docs_by_text = await loop.run_in_executor(
+            executor, _parse_texts, nlp_processor, [text for text, _ in batch], disable
+        )
+    except Exception as e:
+        logger.error("spaCy batch parse of %s texts failed: %s", len(batch), e, exc_info=True)
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for text, future in batch:
+        if not future.done():  # The waiting handler may have been cancelled
+            future.set_result(docs_by_text[text])
@@ -1,37 +1,102 @@
 # utils/parsing_utils.py
+import functools
 import logging
+import re
 from datetime import datetime, date, timedelta
 import calendar
 from typing import Optional, Tuple, Dict, List
+from spacy.tokens import Doc # For type hinting spaCy Doc
+from utils.nlp_cache import NER_ONLY_DISABLED_PIPES, get_cached_doc
 
 logger = logging.getLogger(__name__)
 
-def parse_date_to_timestamp(date_str: Optional[str], text_for_nlp: str, nlp_processor: any) -> int:
+# "October" / "October 2023" periods, resolved with a dict lookup instead of strptime attempts
+_MONTH_NUMBERS_BY_NAME = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_MONTH_NAME_PERIOD_RE = re.compile(r"([a-z]+)(?:\s+(\d{4}))?", re.IGNORECASE | re.ASCII)
+
+@functools.lru_cache(maxsize=64)
+def _date_to_timestamp(target_date: date) -> int:
+    """Local midnight of target_date as a Unix timestamp in milliseconds."""
+    return int(datetime(target_date.year, target_date.month, target_date.day).timestamp() * 1000)
+
+def today_to_timestamp() -> int:
+    """Midnight today (the default expense date) as a Unix timestamp in milliseconds."""
+    return _date_to_timestamp(date.today())
+
+_RELATIVE_DAY_OFFSETS = {"today": 0, "yesterday": 1}
+
+def _parse_iso_date(date_str: str) -> Optional[date]:
+    """
+    Fast path for the zero-padded "YYYY-MM-DD" the AI usually returns, without strptime's
+    format parsing. None for anything else; strptime still handles the other formats.
+    """
+    if len(date_str) != 10 or date_str[4] != "-" or date_str[7] != "-":
+        return None
+    year, month, day = date_str[:4], date_str[5:7], date_str[8:]
+    if not (year.isascii() and year.isdigit() and month.isascii() and month.isdigit()
+            and day.isascii() and day.isdigit()):
+        return None
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError: # Out-of-range month/day
+        return None
+
+# Loose shapes of the formats tried on DATE entities. strptime only runs on text that has
+# the right shape, so entities like "last friday" don't raise three ValueErrors each.
+_ENTITY_DATE_FORMATS = (
+    (re.compile(r"\d+-\d+-\s?\d+"), "%Y-%m-%d"), # 2024-05-01
+    (re.compile(r"\d+/\s?\d+/\d+"), "%m/%d/%Y"), # 05/01/2024
+    (re.compile(r"[^\W\d_]+\s+\d+"), "%B %d"), # May 1 (current year)
+)
+
+def _date_from_entity_text(ent_text: str) -> Optional[date]:
+    """Date for a DATE entity written in one of _ENTITY_DATE_FORMATS, otherwise None."""
+    for shape_re, date_format in _ENTITY_DATE_FORMATS:
+        if shape_re.fullmatch(ent_text):
+            try:
+                parsed_date = datetime.strptime(ent_text, date_format).date()
+                if date_format == "%B %d":
+                    parsed_date = parsed_date.replace(year=date.today().year)
+                return parsed_date
+            except ValueError:
+                pass
+    return None
+
+def parse_date_to_timestamp(date_str: Optional[str], text_for_nlp: str, nlp_processor: any,
+                            doc: Optional[Doc] = None) -> int:
     """
     Parses a date string or extracts date from text_for_nlp using spaCy.
+    doc, if given, is text_for_nlp already parsed by the caller and is used instead.
     Returns a Unix timestamp in milliseconds.
     Defaults to today if no date is found.
     """
     target_date = date.today() # Default to today
+    date_resolved = False # Set once date_str itself gave the date, so the spaCy pass can be skipped
 
     if date_str:
         date_str_lower = date_str.strip().lower()
-        if date_str_lower == "today":
-            target_date = date.today()
-        elif date_str_lower == "yesterday":
-            target_date = date.today() - timedelta(days=1)
+        iso_date = _parse_iso_date(date_str_lower)
+        if date_str_lower in _RELATIVE_DAY_OFFSETS:
+            target_date = date.today() - timedelta(days=_RELATIVE_DAY_OFFSETS[date_str_lower])
+            date_resolved = True
+        elif iso_date is not None:
+            target_date = iso_date
+            date_resolved = True
         else:
             try:
-                target_date = datetime.strptime(date_str_lower, "%Y-%m-%d").date()
+                target_date = datetime.strptime(date_str_lower, "%Y-%m-%d").date() # e.g. "2024-5-1"
+                date_resolved = True
             except ValueError:
                 try:
                     target_date = datetime.strptime(date_str_lower, "%m/%d/%Y").date()
+                    date_resolved = True
                 except ValueError:
-                    logger.warning(f"Could not parse explicit date_str '{date_str_lower}' with simple formats.")
+                    logger.warning("Could not parse explicit date_str '%s' with simple formats.", date_str_lower)
                     pass # Fall through to NLP
 
-    if target_date == date.today() or not date_str:
-        doc = nlp_processor(text_for_nlp)
+    if not date_resolved:
+        if doc is None:
+            doc = get_cached_doc(nlp_processor, text_for_nlp, NER_ONLY_DISABLED_PIPES) # Only DATE entities are read
         parsed_date_from_nlp = None
         for ent in doc.ents:
             if ent.label_ == "DATE":
@@ -42,45 +107,45 @@ def parse_date_to_timestamp(date_str: Optional[str], text_for_nlp: str, nlp_proc
                 elif "yesterday" in ent_text_lower:
                     parsed_date_from_nlp = date.today() - timedelta(days=1)
                     break
-                try:
-                    temp_date = datetime.strptime(ent.text, "%Y-%m-%d").date()
-                    parsed_date_from_nlp = temp_date
+                parsed_date_from_nlp = _date_from_entity_text(ent.text)
+                if parsed_date_from_nlp:
                     break
-                except ValueError:
-                    try:
-                        temp_date = datetime.strptime(ent.text, "%m/%d/%Y").date()
-                        parsed_date_from_nlp = temp_date
-                        break
-                    except ValueError:
-                        try:
-                            temp_date = datetime.strptime(ent.text, "%B %d").date().replace(year=date.today().year)
-                            parsed_date_from_nlp = temp_date
-                            break
-                        except ValueError:
-                            pass
         if parsed_date_from_nlp:
             target_date = parsed_date_from_nlp
         elif not date_str:
-             logger.warning(f"No clear date found in text '{text_for_nlp}' via NLP. Defaulting to today.")
+             logger.warning("No clear date found in text '%s' via NLP. Defaulting to today.", text_for_nlp)
 
-    dt_obj = datetime(target_date.year, target_date.month, target_date.day)
-    return int(dt_obj.timestamp() * 1000)
+    return _date_to_timestamp(target_date)
 
 def determine_category(text: str, nlp_processor: any, predefined_categories: Dict[str, List[str]], default_category: str) -> str:
     """Determines category based on keywords in the text."""
     text_lower = text.lower()
-    doc = nlp_processor(text_lower)
-    lemmatized_keywords_in_text = [token.lemma_ for token in doc if not token.is_stop and not token.is_punct]
+    doc = get_cached_doc(nlp_processor, text_lower) # Full pipeline, lemmas are needed
+    # A set, so each keyword check is a hash lookup instead of a list scan. A multi-word
+    # keyword can never equal a single token's lemma, so only single words can match here.
+    lemmatized_keywords_in_text = {token.lemma_ for token in doc if not token.is_stop and not token.is_punct}
 
     for category, keywords in predefined_categories.items():
-        for keyword in keywords:
-            if keyword in lemmatized_keywords_in_text:
-                if " " in keyword and keyword in text_lower:
-                    return category
-                elif " " not in keyword:
-                    return category
+        if not lemmatized_keywords_in_text.isdisjoint(keywords):
+            return category
     return default_category
 
+@functools.lru_cache(maxsize=256)
+def format_display_period(period_str: Optional[str], start_timestamp_ms: int, end_timestamp_ms: int) -> str:
+    """Human-readable period for summary replies, e.g. "This Month (May 2024)" or "Oct 01, 2023 to Oct 15, 2023"."""
+    display_period_start_dt = datetime.fromtimestamp(start_timestamp_ms / 1000)
+    period_str_lower = period_str.lower() if period_str else ""
+    if period_str_lower == "this month":
+        return f"This Month ({display_period_start_dt.strftime('%B %Y')})"
+    if period_str_lower == "last month":
+        return f"Last Month ({display_period_start_dt.strftime('%B %Y')})"
+
+    display_period_end_dt = datetime.fromtimestamp(end_timestamp_ms / 1000)
+    if period_str and display_period_start_dt.day == 1 and \
+       display_period_end_dt.day == calendar.monthrange(display_period_end_dt.year, display_period_end_dt.month)[1]:
+        return display_period_start_dt.strftime("%B %Y")
+    return f"{display_period_start_dt.strftime('%b %d, %Y')} to {display_period_end_dt.strftime('%b %d, %Y')}"
+
 def parse_period_to_date_range(period_str: Optional[str], nlp_processor: any) -> Tuple[int, int]:
     """
     Parses a period string (e.g., "this month", "last month", "October", "2023-05", "May 2023")
@@ -88,7 +153,13 @@ def parse_period_to_date_range(period_str: Optional[str], nlp_processor: any) ->
     Defaults to "this month" if period_str is None or parsing fails.
     nlp_processor is passed for potential future use in more advanced period parsing.
     """
-    today = date.today()
+    # The range only depends on the string and today's date, and /summary asks for the
+    # "this month" default several times per command, so results are memoized per day
+    return _period_to_date_range(period_str, date.today().toordinal())
+
+@functools.lru_cache(maxsize=256)
+def _period_to_date_range(period_str: Optional[str], today_ordinal: int) -> Tuple[int, int]:
+    today = date.fromordinal(today_ordinal)
     year = today.year
     month = today.month
     
@@ -109,41 +180,36 @@ def parse_period_to_date_range(period_str: Optional[str], nlp_processor: any) ->
             start_date = date(last_day_of_last_month.year, last_day_of_last_month.month, 1)
             end_date = last_day_of_last_month
         else:
-            parsed_specific_month = False
-            try:
-                dt_obj = datetime.strptime(period_str.strip(), "%B %Y") # "October 2023"
-                year, month = dt_obj.year, dt_obj.month
-                parsed_specific_month = True
-            except ValueError:
-                try:
-                    dt_obj = datetime.strptime(period_str.strip(), "%B") # "October" (current year)
-                    month = dt_obj.month
-                    # Year remains current year (already set)
-                    parsed_specific_month = True
-                except ValueError:
-                    try:
-                        year_month_parts = period_str.strip().split('-') # "2023-10"
-                        if len(year_month_parts) == 2:
-                            year, month = int(year_month_parts[0]), int(year_month_parts[1])
-                            parsed_specific_month = True
-                        else: raise ValueError("Not YYYY-MM")
-                    except (ValueError, IndexError):
-                        try:
-                            month_year_parts = period_str.strip().split('/') # "10/2023"
-                            if len(month_year_parts) == 2:
-                                 month, year = int(month_year_parts[0]), int(month_year_parts[1])
-                                 parsed_specific_month = True
-                            else: raise ValueError("Not MM/YYYY")
-                        except (ValueError, IndexError):
-                            logger.warning(f"Could not parse period string '{period_str}'. Defaulting to 'this month'.")
-                            # Default values are already set, so just pass
-
-            if parsed_specific_month:
+            specific_month = _parse_specific_month(period_str.strip(), year)
+            if specific_month:
+                year, month = specific_month
                 start_date = date(year, month, 1)
                 _, last_day_of_month = calendar.monthrange(year, month)
                 end_date = date(year, month, last_day_of_month)
+            else:
+                logger.warning("Could not parse period string '%s'. Defaulting to 'this month'.", period_str)
 
-    start_timestamp_ms = int(datetime(start_date.year, start_date.month, start_date.day, 0, 0, 0).timestamp() * 1000)
+    start_timestamp_ms = _date_to_timestamp(start_date)
     end_timestamp_ms = int(datetime(end_date.year, end_date.month, end_date.day, 23, 59, 59, 999999).timestamp() * 1000)
     
     return start_timestamp_ms, end_timestamp_ms
+
+def _parse_specific_month(period: str, current_year: int) -> Optional[Tuple[int, int]]:
+    """(year, month) for "October 2023", "October" (current year), "2023-10" or "10/2023", otherwise None."""
+    month_name_match = _MONTH_NAME_PERIOD_RE.fullmatch(period)
+    if month_name_match:
+        month = _MONTH_NUMBERS_BY_NAME.get(month_name_match.group(1).lower())
+        year_text = month_name_match.group(2)
+        if month is None or (year_text and int(year_text) < 1): # Year 0000 is not a valid date
+            return None
+        return (int(year_text) if year_text else current_year), month
+
+    for separator, year_first in (("-", True), ("/", False)): # "2023-10", then "10/2023"
+        parts = period.split(separator)
+        if len(parts) == 2:
+            try:
+                first, second = int(parts[0]), int(parts[1])
+            except ValueError:
+                continue
+            return (first, second) if year_first else (second, first)
+    return None